@@ -0,0 +1,528 @@
+"""Contain functions for benchmarking the synthesis, mixing and export paths.
+
+This file contains benchmarks for tone generation, melodies, score
+parsing, mixing, splicing, echoes, resampling, saving and streaming. Each benchmark
+reports the number of samples processed per second and the peak memory
+it used. Streaming benchmarks also report the time taken to produce
+their slower frames, which must stay well under the time the frame takes
+to play. Results can be saved as a JSON baseline, and later runs can be
+compared against a baseline to flag regressions.
+
+Running this file runs every benchmark and prints the results:
+python benchmark.py --save baseline.json
+python benchmark.py --compare baseline.json
+"""
+
+
+# Standard Python libraries
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+# Additional libraries
+import numpy
+
+# Own modules
+import cache
+import envelope
+import melody
+import sound
+import tone
+
+
+# Lengths of the sounds used for the mixing and effect benchmarks in samples
+BUFFER_SIZES = [44100, 441000, 4410000]
+# Number of notes in the long melody benchmarks
+SCORE_LENGTH = 2000
+# Each benchmark is run this many times and the fastest is reported
+REPEATS = 3
+# Fraction that speed can drop or memory can rise by before it is a regression
+DEFAULT_TOLERANCE = 0.2
+# Memory differences smaller than this are ignored, as they are just noise (KB)
+MEMORY_NOISE = 1024
+# Number of pitch variants rendered by the variant benchmarks
+VARIANT_COUNT = 100
+# Frame sizes for the streaming benchmarks in samples
+FRAME_SIZES = [256, 512, 1024]
+# Fraction of a frame's duration the slower frames can take without risking dropouts
+FRAME_BUDGET = 0.5
+# Percentile of frame times checked against the budget, as the single slowest frame
+# of a run is often slowed by the operating system rather than by the stream
+FRAME_PERCENTILE = 99
+
+
+def get_benchmarks():
+    """Return a dictionary of benchmark names to their setup functions.
+
+    Each setup function prepares everything a benchmark needs and returns
+    a tuple of a function that runs the benchmark and the number of samples
+    that it processes. Setting up isn't included in the time taken.
+    """
+
+    benchmarks = {}
+
+    tone_classes = [tone.SineTone, tone.SquareTone, tone.SawTone, tone.TriangleTone]
+    for tone_class in tone_classes:
+        for with_envelopes in (False, True):
+            name = "create_tone/%s%s" % (tone_class.__name__, "/envelopes" if with_envelopes else "")
+            benchmarks[name] = make_tone_benchmark(tone_class, with_envelopes)
+    for with_envelopes in (False, True):
+        benchmarks["create_tone/HarmonicSawTone%s" % ("/envelopes" if with_envelopes else "")] = \
+            make_tone_benchmark(tone.HarmonicSawTone, with_envelopes, 20)
+    benchmarks["create_tone/Noise"] = make_tone_benchmark(tone.Noise, False)
+    for colour in [tone.NoiseColour.pink, tone.NoiseColour.brown]:
+        benchmarks["create_tone/Noise/%s" % colour.name] = make_tone_benchmark(tone.Noise, False, colour=colour)
+    benchmarks["create_tones/batched"] = make_variants_benchmark(True)
+    benchmarks["create_tones/individual"] = make_variants_benchmark(False)
+
+    benchmarks["create_melody/cached"] = make_melody_benchmark(True)
+    benchmarks["create_melody/uncached"] = make_melody_benchmark(False)
+    benchmarks["compile_score"] = make_score_benchmark()
+
+    for size in BUFFER_SIZES:
+        benchmarks["layer_sound_at_time/%d" % size] = make_sound_benchmark(size, layer_sound)
+        benchmarks["add/%d" % size] = make_sound_benchmark(size, add_sounds)
+        benchmarks["insert_sound_at_time/%d" % size] = make_sound_benchmark(size, insert_sound)
+        benchmarks["echo/%d" % size] = make_sound_benchmark(size, echo_sound)
+        benchmarks["feedback_echo/%d" % size] = make_sound_benchmark(size, feedback_echo_sound)
+        benchmarks["save/%d" % size] = make_sound_benchmark(size, save_sound)
+        for encoding in [sound.Encoding.mu_law, sound.Encoding.ima_adpcm]:
+            benchmarks["save/%s/%d" % (encoding.name, size)] = \
+                make_sound_benchmark(size, lambda target, other, encoding=encoding: save_sound(target, other, encoding))
+        benchmarks["resample/%d" % size] = make_sound_benchmark(size, resample_sound)
+        # Stereo should cost close to mono, as channels are processed together
+        benchmarks["layer_sound_at_time/stereo/%d" % size] = make_sound_benchmark(size, pan_sound, 2)
+        benchmarks["echo/stereo/%d" % size] = make_sound_benchmark(size, echo_sound, 2)
+
+    for frame_size in FRAME_SIZES:
+        benchmarks["stream_tone/%d" % frame_size] = make_stream_benchmark(frame_size, False)
+        benchmarks["stream_melody/%d" % frame_size] = make_stream_benchmark(frame_size, True)
+
+    return benchmarks
+
+
+def make_tone_benchmark(tone_class, with_envelopes, levels=None, colour=None):
+    """Return a setup function for creating a 10 second tone.
+
+    Arguments:
+    tone_class -- the Tone subclass to create
+    with_envelopes -- whether amplitude and frequency envelopes should be applied
+    levels -- the number of harmonics, for HarmonicSawTone
+    colour -- the tone.NoiseColour, for Noise
+    """
+
+    def setup():
+        seconds = 10
+        amplitude_env = None
+        frequency_env = None
+        if with_envelopes:
+            amplitude_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 1000, 0.1, 0.2, 0.5, 0.2)
+            frequency_env = envelope.Envelope(envelope.EnvelopeType.frequency, -5, 0.5, 0.5, 0, 0)
+            # So that rendering the curves is part of the benchmark
+            envelope.Envelope.clear_cache()
+
+        if tone_class == tone.Noise:
+            instrument = tone.Noise(2000, seconds, colour=colour)
+        elif levels != None:
+            instrument = tone_class(0, 2000, seconds, levels, amplitude_env, frequency_env)
+        else:
+            instrument = tone_class(0, 2000, seconds, amplitude_env, frequency_env)
+        sample_count = sound.Sound().convert_secs_to_samples(seconds)
+        return instrument.create_tone, sample_count
+
+    return setup
+
+
+def make_variants_benchmark(batched):
+    """Return a setup function for creating VARIANT_COUNT short pitch variants of a tone.
+
+    Arguments:
+    batched -- whether the variants are created at once with create_tones, or one voice at a time
+    """
+
+    def setup():
+        amplitude_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0.5, 0.5)
+        frequency_env = envelope.Envelope(envelope.EnvelopeType.frequency, -5, 0.5, 0.5, 0, 0)
+        instrument = tone.SquareTone(0, 2000, 0.1, amplitude_env, frequency_env)
+        notes = [note % 48 - 24 for note in xrange(VARIANT_COUNT)]
+        amplitudes = [1000 + 10 * note for note in xrange(VARIANT_COUNT)]
+        sample_count = VARIANT_COUNT * sound.Sound().convert_secs_to_samples(instrument.seconds)
+
+        def create_variants():
+            # So that rendering the curves is part of every run
+            envelope.Envelope.clear_cache()
+            if batched:
+                return instrument.create_tones(notes, instrument.seconds, amplitudes)
+            return [instrument.create_tone(tone.Voice(note, instrument.seconds, None, amplitude))
+                    for note, amplitude in zip(notes, amplitudes)]
+        return create_variants, sample_count
+
+    return setup
+
+
+def make_melody_benchmark(use_cache):
+    """Return a setup function for creating a long melody.
+
+    Arguments:
+    use_cache -- whether the note cache should be used
+    """
+
+    def setup():
+        notes = ["E:3:16", "B:2:16", "D:3:8", "A:2:16", "C#:3:8.", "F:3:4", "G:2:16", "Ab:3:8"]
+        note_string = " ".join(notes[i % len(notes)] for i in xrange(SCORE_LENGTH))
+        short_sound_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0, 1)
+        instrument = tone.SquareTone(0, 2000, 0, short_sound_env)
+        music = melody.Melody(180, '6/8')
+        if use_cache:
+            music.note_cache = cache.LRUCache(max_bytes=melody.NOTE_CACHE_SIZE)
+        else:
+            music.note_cache = cache.LRUCache(max_bytes=0)
+
+        sample_count = len(music.create_melody(note_string, instrument))
+        music.note_cache.clear()
+        return lambda: music.create_melody(note_string, instrument), sample_count
+
+    return setup
+
+
+def make_score_benchmark():
+    """Return a setup function for compiling a score of SCORE_LENGTH * 10 notes.
+
+    The number of samples is the number of notes, so the result is notes per second.
+    """
+
+    def setup():
+        notes = ["E:3:16", "B:2:16", "D:3:8", "A:2:16", "C#:3:8.", "F:3:4", "G:2:16", "Ab:3:8"]
+        note_string = " ".join(notes[i % len(notes)] for i in xrange(SCORE_LENGTH * 10))
+        music = melody.Melody(180, '6/8')
+        music.score_cache = cache.LRUCache(melody.SCORE_CACHE_SIZE)
+        return lambda: music.compile_score(note_string), SCORE_LENGTH * 10
+
+    return setup
+
+
+def make_sound_benchmark(size, operation, channels=1):
+    """Return a setup function for an operation on a sound of the given size.
+
+    Arguments:
+    size -- the length of the sound in frames
+    operation -- function taking the sound and another mono sound half its length
+    channels -- the number of channels of the sound. Defaults to 1
+    """
+
+    def setup():
+        seconds = float(size) / 44100
+        target = tone.SineTone(0, 2000, seconds).create_tone()
+        if channels > 1:
+            mono_target = target
+            target = sound.Sound(channels=channels)
+            target.layer_sound_at_time(mono_target, 0)
+        other = tone.SquareTone(7, 1000, seconds / 2).create_tone()
+        return lambda: operation(target, other), size
+
+    return setup
+
+
+def make_stream_benchmark(frame_size, is_melody):
+    """Return a setup function for reading every frame of a stream.
+
+    The run function returns the FRAME_PERCENTILE percentile and the
+    longest of the times taken to read a frame, and the time a frame takes
+    to play, so the slower frames can be checked against the real-time
+    budget.
+
+    Arguments:
+    frame_size -- the number of samples in each frame
+    is_melody -- whether to stream a long melody rather than a 10 second tone
+    """
+
+    def setup():
+        amplitude_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 1000, 0.1, 0.2, 0.5, 0.2)
+        # So that rendering the curves is part of the benchmark
+        envelope.Envelope.clear_cache()
+        if is_melody:
+            notes = ["E:3:16", "B:2:16", "D:3:8", "A:2:16", "C#:3:8.", "F:3:4", "G:2:16", "Ab:3:8"]
+            note_string = " ".join(notes[i % len(notes)] for i in xrange(SCORE_LENGTH // 10))
+            music = melody.Melody(180, '6/8')
+            music.note_cache = cache.LRUCache(max_bytes=0)
+            instrument = tone.HarmonicSawTone(0, 2000, 0, 20, amplitude_env)
+            # The length only depends on the notes, so a quick tone is used to find it
+            sample_count = len(music.create_melody(note_string, tone.SquareTone(0, 2000, 0)))
+            frames = music.stream_melody(note_string, instrument, frame_size=frame_size)
+        else:
+            seconds = 10
+            sample_count = sound.Sound().convert_secs_to_samples(seconds)
+            frames = tone.HarmonicSawTone(0, 2000, seconds, 20, amplitude_env).stream_tone(frame_size=frame_size)
+        frame_duration = frame_size / 44100.0
+
+        def run():
+            frame_times = []
+            # An audio thread wouldn't be stopped by the garbage collector
+            gc.disable()
+            try:
+                while not frames.finished:
+                    start_time = time.time()
+                    frames.read_frame()
+                    frame_times.append(time.time() - start_time)
+            finally:
+                gc.enable()
+            return {'percentile_frame_seconds': float(numpy.percentile(frame_times, FRAME_PERCENTILE)),
+                    'worst_frame_seconds': max(frame_times), 'frame_seconds': frame_duration}
+
+        return run, sample_count
+
+    return setup
+
+
+def layer_sound(target, other):
+    target.layer_sound_at_time(other, 0.25)
+
+
+def pan_sound(target, other):
+    target.layer_sound_at_time(other, 0.25, 0.5)
+
+
+def add_sounds(target, other):
+    target + other
+
+
+def insert_sound(target, other):
+    target.insert_sound_at_time(other, 0.25)
+
+
+def echo_sound(target, other):
+    target.echo(0.1, 0.5)
+
+
+def feedback_echo_sound(target, other):
+    target.feedback_echo(0.1, 0.5)
+
+
+def resample_sound(target, other):
+    # Copied, as resampling changes the sampling rate of the sound
+    target.copy().resample(22050)
+
+
+def save_sound(target, other, encoding=None):
+    directory = tempfile.mkdtemp()
+    try:
+        target.save(directory, "benchmark.wav", encoding=encoding)
+    finally:
+        shutil.rmtree(directory)
+
+
+def run_benchmark(name):
+    """Run a benchmark and return its name and results as a tuple.
+
+    This is run in its own process so that the peak memory of one
+    benchmark isn't affected by the others, and each repeat is run with
+    measure_run so that its peak memory doesn't include its setup.
+    If a benchmark's run function returns a dictionary of frame times, they
+    are reported from the repeat whose FRAME_PERCENTILE percentile frame
+    time was fastest, as other processes can only make frames slower.
+
+    Arguments:
+    name -- the name of the benchmark from get_benchmarks
+    """
+
+    setup = get_benchmarks()[name]
+    best_time = None
+    peak_memory = 0
+    frame_times = None
+    for i in xrange(REPEATS):
+        run, sample_count = setup()
+        elapsed, run_memory, run_result = measure_run(run)
+        peak_memory = max(peak_memory, run_memory)
+        if best_time == None or elapsed < best_time:
+            best_time = elapsed
+        # Other benchmarks return whatever the operation returns
+        if isinstance(run_result, dict) and (frame_times == None or run_result['percentile_frame_seconds'] <
+                                             frame_times['percentile_frame_seconds']):
+            frame_times = run_result
+
+    # Avoid dividing by 0 for benchmarks too fast for the clock
+    best_time = max(best_time, 1e-9)
+    result = {'seconds': best_time, 'samples': sample_count,
+              'samples_per_second': sample_count / best_time, 'peak_memory_kb': peak_memory}
+    if frame_times != None:
+        result.update(frame_times)
+    return name, result
+
+
+def measure_run(run):
+    """Call a benchmark's run function in a forked process and return its time, peak memory and result.
+
+    The peak memory of a process is the most it has ever used, so memory
+    used by the setup, even if it has been freed, would hide memory used
+    by the run. A forked process's peak memory starts at the memory the
+    parent is using when it forks, so forking after the setup means only
+    the memory the run itself allocates is counted.
+    The result is returned if it is a dictionary of frame times, otherwise
+    None, as it has to be sent back from the forked process.
+
+    Arguments:
+    run -- the function that runs the benchmark, from its setup function
+    """
+
+    read_end, write_end = os.pipe()
+    process_id = os.fork()
+    if process_id == 0:
+        os.close(read_end)
+        exit_code = 1
+        try:
+            memory_before = get_peak_memory()
+            start_time = time.time()
+            run_result = run()
+            elapsed = time.time() - start_time
+            run_memory = get_peak_memory() - memory_before
+            if not isinstance(run_result, dict):
+                run_result = None
+            with os.fdopen(write_end, 'w') as pipe:
+                json.dump([elapsed, run_memory, run_result], pipe)
+            exit_code = 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # Skip the parent's clean up, which belongs to the parent
+            os._exit(exit_code)
+
+    os.close(write_end)
+    with os.fdopen(read_end) as pipe:
+        output = pipe.read()
+    process_id, status = os.waitpid(process_id, 0)
+    if status != 0:
+        raise RuntimeError("The benchmark's run failed in its forked process")
+    return json.loads(output)
+
+
+def get_peak_memory():
+    """Return the peak memory used by this process so far in KB."""
+
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Mac OS reports it in bytes rather than KB
+    if sys.platform == 'darwin':
+        peak_memory //= 1024
+    return peak_memory
+
+
+def run_benchmarks(name_filter=None):
+    """Run the benchmarks, each in a new process, and return a dictionary of their results.
+
+    Arguments:
+    name_filter -- only benchmarks whose names contain this string are run. Defaults to None (all)
+    """
+
+    names = sorted(name for name in get_benchmarks() if name_filter == None or name_filter in name)
+    # A new process for each benchmark so that peak memory is measured separately
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = dict(pool.map(run_benchmark, names, chunksize=1))
+    pool.close()
+    pool.join()
+    return results
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of messages describing regressions from the baseline.
+
+    A benchmark has regressed if it processes samples more slowly, or uses
+    more memory, than the baseline by more than the tolerance.
+
+    Arguments:
+    results -- dictionary of results from run_benchmarks
+    baseline -- dictionary of results from an earlier run
+    tolerance -- fraction that results can be worse by. Defaults to DEFAULT_TOLERANCE
+    """
+
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        result = results[name]
+        expected = baseline[name]
+
+        minimum_speed = expected['samples_per_second'] * (1 - tolerance)
+        if result['samples_per_second'] < minimum_speed:
+            regressions.append("%s: %.0f samples/s, baseline %.0f samples/s" %
+                               (name, result['samples_per_second'], expected['samples_per_second']))
+
+        maximum_memory = expected['peak_memory_kb'] * (1 + tolerance) + MEMORY_NOISE
+        if result['peak_memory_kb'] > maximum_memory:
+            regressions.append("%s: %d KB peak memory, baseline %d KB" %
+                               (name, result['peak_memory_kb'], expected['peak_memory_kb']))
+    return regressions
+
+
+def find_missed_budgets(results):
+    """Return a list of messages describing streams too slow to play in real time.
+
+    A stream has missed its budget if its FRAME_PERCENTILE percentile frame
+    time is longer than FRAME_BUDGET of the time the frame takes to play.
+
+    Arguments:
+    results -- dictionary of results from run_benchmarks
+    """
+
+    missed = []
+    for name in sorted(results):
+        result = results[name]
+        if 'percentile_frame_seconds' not in result:
+            continue
+        budget = result['frame_seconds'] * FRAME_BUDGET
+        if result['percentile_frame_seconds'] > budget:
+            missed.append("%s: %dth percentile frame %.3fms, budget %.3fms" %
+                          (name, FRAME_PERCENTILE, result['percentile_frame_seconds'] * 1000, budget * 1000))
+    return missed
+
+
+def print_results(results):
+    """Print the results of the benchmarks as a table."""
+
+    print("%-36s %16s %14s %20s %10s" % ("benchmark", "samples/s", "peak memory",
+                                         "p%d frame" % FRAME_PERCENTILE, "slowest"))
+    for name in sorted(results):
+        result = results[name]
+        line = "%-36s %16.0f %11d KB" % (name, result['samples_per_second'], result['peak_memory_kb'])
+        if 'percentile_frame_seconds' in result:
+            line += " %8.3fms of %6.3fms %8.3fms" % (result['percentile_frame_seconds'] * 1000,
+                                                     result['frame_seconds'] * 1000,
+                                                     result['worst_frame_seconds'] * 1000)
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark synthesis, mixing and export.")
+    parser.add_argument('--filter', help="only run benchmarks whose names contain this")
+    parser.add_argument('--save', metavar='FILE', help="save the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE', help="flag regressions against a JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="fraction results can be worse than the baseline by")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(args.filter)
+    print_results(benchmark_results)
+
+    if args.save:
+        with open(args.save, 'w') as baseline_file:
+            json.dump(benchmark_results, baseline_file, indent=4, sort_keys=True)
+
+    found = find_missed_budgets(benchmark_results)
+    for message in found:
+        print("TOO SLOW " + message)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = find_regressions(benchmark_results, json.load(baseline_file), args.tolerance)
+        for message in regressions:
+            print("REGRESSION " + message)
+        found += regressions
+
+    if found:
+        raise SystemExit(1)
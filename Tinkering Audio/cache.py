@@ -0,0 +1,140 @@
+"""Contain a class for caching rendered audio data.
+
+This module contains a class that can be used to keep rendered data,
+such as envelope curves and notes, so that it doesn't have to be
+calculated again when it is needed more than once.
+
+Classes:
+LRUCache -- cache that discards the least recently used values when full
+"""
+
+
+# Standard Python libraries
+import collections
+import threading
+
+
+class LRUCache(object):
+
+    """Contain methods and fields for a least recently used cache.
+
+    This class stores values by key up to a maximum number of entries
+    and/or a maximum total size in bytes. When the cache is full, the
+    values that were used least recently are discarded to make room for
+    the new one. The number of hits, misses and evictions are counted so
+    that the cache can be tuned.
+    The cache can be shared by threads, as only one can use it at a time.
+
+    Public Methods:
+    get -- returns the value stored for a key
+    put -- stores a value for a key
+    clear -- removes all values from the cache and resets the statistics
+    get_stats -- returns the statistics of the cache as a dictionary
+
+    Public Fields and Properties:
+    max_entries -- the maximum number of values that will be stored
+    max_bytes -- the maximum total size of the values that will be stored
+    size -- the total size of the stored values in bytes
+    hits -- the number of times get found a value
+    misses -- the number of times get didn't find a value
+    evictions -- the number of values discarded to make room
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        """Initialise the fields.
+
+        Arguments:
+        max_entries -- the maximum number of values that will be stored. Defaults to None (no limit)
+        max_bytes -- the maximum total size of the values in bytes. Defaults to None (no limit)
+        """
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Each key stores a tuple of the value and its size
+        self.__entries = collections.OrderedDict()
+        self.__size = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.__size
+
+    def get(self, key):
+        """Return the value stored for the key, or None if it isn't stored."""
+
+        with self.__lock:
+            if key not in self.__entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            # Move the value to the end so it is the most recently used
+            entry = self.__entries.pop(key)
+            self.__entries[key] = entry
+            return entry[0]
+
+    def put(self, key, value, size=0):
+        """Store the value for the key, discarding old values if the cache is full.
+
+        Values bigger than max_bytes are not stored.
+
+        Arguments:
+        key -- the key the value is stored under
+        value -- the value to store
+        size -- the size of the value in bytes. Defaults to 0
+        """
+
+        if self.max_bytes != None and size > self.max_bytes:
+            return
+
+        with self.__lock:
+            if key in self.__entries:
+                self.__size -= self.__entries.pop(key)[1]
+            self.__entries[key] = (value, size)
+            self.__size += size
+
+            while self.__is_full():
+                # Least recently used value is at the start
+                discarded_key, (discarded_value, discarded_size) = self.__entries.popitem(last=False)
+                self.__size -= discarded_size
+                self.evictions += 1
+
+    def clear(self):
+        """Remove all values from the cache and set the hits, misses and evictions back to 0."""
+
+        with self.__lock:
+            self.__entries.clear()
+            self.__size = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self):
+        """Return the hits, misses, evictions, entries, size and hit rate as a dictionary.
+
+        The hits, misses and evictions are counted from when the cache was
+        created or last cleared.
+        """
+
+        lookups = self.hits + self.misses
+        hit_rate = float(self.hits) / lookups if lookups else 0.0
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.__entries), 'size': self.__size, 'hit_rate': hit_rate}
+
+    def __is_full(self):
+        """Return whether the cache is over either of its limits."""
+
+        if self.max_entries != None and len(self.__entries) > self.max_entries:
+            return True
+        if self.max_bytes != None and self.__size > self.max_bytes:
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, key):
+        return key in self.__entries
@@ -0,0 +1,177 @@
+"""Contain classes for audio effects.
+
+This module contains classes for effects that can be applied to blocks
+of samples. The effects keep their state between blocks, so they can be
+applied to a whole sound or to audio as it is streamed.
+
+Classes:
+CombFilter -- class for adding echoes with a comb filter
+OnePoleFilter -- class for smoothing a signal with a one-pole low-pass filter
+"""
+
+
+# Additional libraries
+import numpy
+
+
+# Powers of a one-pole coefficient below this are too small to change a 64-bit float
+NEGLIGIBLE_GAIN = 1e-17
+
+
+class CombFilter(object):
+
+    """Contain methods and fields for a comb filter.
+
+    This class adds delayed copies of a signal to itself. A feed-forward
+    filter echoes the original signal only, and a feedback filter echoes
+    its own output, so each echo is echoed again.
+    There can be any number of taps, each with its own delay and volume.
+    Samples from the end of each block are kept so that blocks can be
+    processed one after another as if they were one signal.
+    Blocks can have a column for each channel, in which case every channel
+    is echoed at once with the same taps.
+
+    Public Methods:
+    process -- returns a block of samples with the echoes added
+    flush -- returns the echoes that carry on after the last block
+    reset -- forgets the previous blocks
+
+    Public Fields and Properties:
+    taps -- list of (delay in samples, volume) tuples
+    feedback -- whether the filter echoes its own output
+    """
+
+    def __init__(self, taps, feedback=False):
+        """Initialise the fields.
+
+        Arguments:
+        taps -- list of (delay in samples, volume) tuples, where volume is the
+                fraction of the original volume the echo will be
+        feedback -- whether the filter echoes its own output. Defaults to False
+        """
+
+        self.taps = [(int(delay), vol_reduction) for delay, vol_reduction in taps]
+        self.feedback = feedback
+
+        if not self.taps or min(delay for delay, vol_reduction in self.taps) < 1:
+            raise ValueError("Comb filter taps must have delays of at least 1 sample")
+
+        self.__max_delay = max(delay for delay, vol_reduction in self.taps)
+        self.__min_delay = min(delay for delay, vol_reduction in self.taps)
+        self.reset()
+
+    def reset(self):
+        """Forget the previous blocks so the next block is treated as the start."""
+
+        # The last max_delay input samples, or output samples for feedback,
+        # created once the number of channels is known from the first block
+        self.__history = None
+
+    def process(self, block):
+        """Return the block of samples with the echoes added as a numpy array of floats.
+
+        Arguments:
+        block -- the samples to filter as a numpy array, or a numpy array of frames
+        """
+
+        block = numpy.asarray(block, dtype=float)
+        count = len(block)
+        if self.__history is None:
+            self.__history = numpy.zeros((self.__max_delay,) + block.shape[1:])
+        # The history followed by the block, so delays can reach back into previous blocks
+        signal = numpy.concatenate((self.__history, block))
+        history_length = self.__max_delay
+
+        if self.feedback:
+            # Echoes depend on output, so work through the block in steps no
+            # longer than the shortest delay, so each step only needs output
+            # from before it
+            for start in xrange(0, count, self.__min_delay):
+                end = min(start + self.__min_delay, count)
+                step = signal[history_length + start:history_length + end].copy()
+                for delay, vol_reduction in self.taps:
+                    step += vol_reduction * signal[history_length + start - delay:history_length + end - delay]
+                signal[history_length + start:history_length + end] = step
+            output = signal[history_length:]
+        else:
+            output = signal[history_length:].copy()
+            for delay, vol_reduction in self.taps:
+                output += vol_reduction * signal[history_length - delay:history_length - delay + count]
+
+        self.__history = signal[-history_length:].copy()
+        return output
+
+    def flush(self):
+        """Return the echoes that carry on for the longest delay after the last block."""
+
+        channels = self.__history.shape[1:] if self.__history is not None else ()
+        return self.process(numpy.zeros((self.__max_delay,) + channels))
+
+
+class OnePoleFilter(object):
+
+    """Contain methods and fields for a one-pole low-pass filter.
+
+    This class smooths a signal by adding a fraction of its previous output
+    to each sample, so each output is coefficient * previous output + gain
+    * input. Rather than working through a block one sample at a time, the
+    whole block is solved at once with a scan. Each pass adds the output
+    from twice as far back as the pass before, multiplied by the coefficient
+    to that power, so at most log2 of the block's length passes are needed.
+    The passes stop as soon as the power is too small to change the output.
+    The last output of each block is kept so that blocks can be processed
+    one after another as if they were one signal, and blocks can have a
+    column for each channel, like CombFilter.
+
+    Public Methods:
+    process -- returns a block of samples with the filter applied
+    reset -- forgets the previous blocks
+
+    Public Fields and Properties:
+    coefficient -- the fraction of the previous output added to each sample
+    gain -- the number the input is multiplied by
+    """
+
+    def __init__(self, coefficient, gain=1.0):
+        """Initialise the fields.
+
+        Arguments:
+        coefficient -- the fraction of the previous output added to each sample, from 0 up to but not including 1
+        gain -- the number the input is multiplied by. Defaults to 1.0
+        """
+
+        if not 0 <= coefficient < 1:
+            raise ValueError("One-pole filter coefficients must be at least 0 and less than 1")
+
+        self.coefficient = coefficient
+        self.gain = gain
+        self.reset()
+
+    def reset(self):
+        """Forget the previous blocks so the next block is treated as the start."""
+
+        self.__previous = 0.0
+
+    def process(self, block):
+        """Return the block of samples with the filter applied as a numpy array of floats.
+
+        Arguments:
+        block -- the samples to filter as a numpy array, or a numpy array of frames
+        """
+
+        output = self.gain * numpy.asarray(block, dtype=float)
+        count = len(output)
+
+        shift = 1
+        power = self.coefficient
+        while shift < count and power > NEGLIGIBLE_GAIN:
+            output[shift:] = output[shift:] + power * output[:-shift]
+            shift *= 2
+            power *= power
+
+        # Carry on from the last output of the previous block
+        decay = self.coefficient ** numpy.arange(1, count + 1)
+        output += decay.reshape((count,) + (1,) * (output.ndim - 1)) * self.__previous
+        if count:
+            self.__previous = output[-1].copy()
+        return output
@@ -6,10 +6,21 @@ EnvelopePhase(Enum) -- enum to store which phase the envelope is in
 EnvelopeType(Enum) -- enum to store the type of an envelope
 """
 
+# Standard Python library
+import math
+
+# Additional libraries
 from enum import Enum
+import numpy
+
+# Own modules
+import cache
+import profiler
 
 # Minimum threshold of human hearing
 MIN_FREQUENCY = 20
+# Number of rendered envelope curves kept for reuse
+CURVE_CACHE_SIZE = 64
 
 class Envelope(object):
 
@@ -20,8 +31,16 @@ class Envelope(object):
 
     Public Methods:
     get_value -- return the value of the amplitude or frequency after envelope has been applied
+    render -- return the values of the amplitude or frequency for every sample of a sound
+    clear_cache -- forget all rendered curves
+
+    Public Fields and Properties:
+    key -- tuple of the envelope's parameters that identifies the curve it produces
     """
 
+    # Rendered curves are shared between all envelopes with the same parameters
+    __curves = cache.LRUCache(CURVE_CACHE_SIZE)
+
     def __init__(self, type, sustain_level, attack_length, decay_length, sustain_length, release_length):
         """Initialise the fields.
 
@@ -44,11 +63,18 @@ class Envelope(object):
         self.sustain_length = sustain_length
         self.release_length = release_length
 
+    @property
+    def key(self):
+        return (self.type, self.sustain_level, self.attack_length, self.decay_length,
+                self.sustain_length, self.release_length)
+
     def get_value(self, default_value, sample_index, number_of_samples):
         """Return the appropriate amplitude or frequency value according to the envelope phase times.
 
         This method calculates the value that amplitude of frequency should take with the
         envelope applied to it.
+        Tones use render instead, so this is kept as a reference for the values
+        render should give for each sample.
 
         Arguments:
         default value -- the default amplitude or frequency of the tone
@@ -86,6 +112,98 @@ class Envelope(object):
 
             return new_value
 
+    def render(self, number_of_samples, default_value):
+        """Return the amplitude or frequency values for every sample as an array.
+
+        This method calculates the whole envelope curve at once, one phase at a
+        time, giving the same values as calling get_value for each sample.
+        Curves are cached by the envelope parameters, number of samples and
+        default value, so rendering the same curve again doesn't recalculate it.
+        Only the curves that are calculated are measured by the profiler, so
+        its samples are the samples calculated rather than those looked up.
+        The returned array is shared and so is read-only.
+        If default_value is a numpy array with one value per row, such as a
+        column of amplitudes, a curve is calculated for each row at once and
+        returned as a 2D array.
+
+        Arguments:
+        number_of_samples -- the total number of samples in the tone
+        default_value -- the default amplitude or frequency of the tone, or a numpy column of them
+        """
+
+        batched = numpy.ndim(default_value) > 0
+        default_values = numpy.ravel(default_value)
+        # Arrays can't be hashed, so a batch is keyed by its values
+        key = (self.key, number_of_samples, tuple(default_values.tolist()) if batched else default_value)
+        curve = Envelope.__curves.get(key)
+        if curve is None:
+            curve = self.__render_curve(number_of_samples, default_values)
+            if not batched:
+                curve = curve[0]
+            curve.flags.writeable = False
+            Envelope.__curves.put(key, curve)
+        return curve
+
+    @staticmethod
+    def clear_cache():
+        """Forget all rendered curves, so they are calculated again when next rendered."""
+
+        Envelope.__curves.clear()
+
+    @profiler.measure('Envelope.render', lambda self, number_of_samples, default_values:
+                      int(math.ceil(number_of_samples)) * len(default_values))
+    def __render_curve(self, number_of_samples, default_values):
+        """Calculate a row of the envelope curve for each default value for render.
+
+        The phases of the envelope cover consecutive ranges of sample indices,
+        so each phase is calculated over its range with array operations. The
+        phase boundaries are the same for every row, so they are only worked
+        out once.
+        """
+
+        # A column, so each row is calculated with its own default value
+        default_value = default_values[:, numpy.newaxis]
+
+        attack_end = self.__get_attack_length(number_of_samples)
+        decay_end = attack_end + self.__get_decay_length(number_of_samples)
+        sustain_end = decay_end + self.__get_sustain_length(number_of_samples)
+
+        # The first sample index that is not before each boundary
+        length = int(math.ceil(number_of_samples))
+        attack_stop = min(int(math.ceil(attack_end)), length)
+        decay_stop = min(max(int(math.ceil(decay_end)), attack_stop), length)
+        sustain_stop = min(max(int(math.ceil(sustain_end)), decay_stop), length)
+
+        indices = numpy.arange(length, dtype=float)
+        curve = numpy.empty((len(default_values), length))
+
+        attack = indices[:attack_stop]
+        if len(attack):
+            curve[:, :attack_stop] = default_value * (attack / float(attack_end))
+
+        decay = indices[attack_stop:decay_stop]
+        if len(decay):
+            # Same line through 2 points as __get_decay
+            sustain_level = self.__get_sustain(default_value)
+            m = (1.0 - (sustain_level / default_value.astype(float))) / (attack_end - decay_end)
+            c = 1.0 - m * attack_end
+            curve[:, attack_stop:decay_stop] = default_value * (m * decay + c)
+
+        curve[:, decay_stop:sustain_stop] = self.__get_sustain(default_value)
+
+        release = indices[sustain_stop:]
+        if len(release):
+            release_length = self.__get_release_length(number_of_samples)
+            envelope = 1.0 - ((release - sustain_end) / float(release_length))
+            curve[:, sustain_stop:] = envelope * self.__get_sustain(default_value)
+
+        if self.type == EnvelopeType.frequency:
+            # The sustain phase is never limited, as in get_value
+            curve[:, :decay_stop] = numpy.maximum(curve[:, :decay_stop], MIN_FREQUENCY)
+            curve[:, sustain_stop:] = numpy.maximum(curve[:, sustain_stop:], MIN_FREQUENCY)
+
+        return curve
+
     def __get_attack(self, sample_index, number_of_samples):
         """Return the multiplier for the attack phase of the envelope
 
@@ -2,31 +2,257 @@
 
 This file contains functions that will create the gameplay audio
 for the Kivy mobile game project - Hotrod the Beetle.
+The sounds can be built in parallel by running with --workers.
+Only sounds whose recipes have changed are rebuilt, unless --force is used.
+Running with --profile breaks down where the time went in each sound.
+The sounds are saved at 44.1kHz unless another rate is given with --rate.
+With --oversample they are rendered at a multiple of that rate and
+decimated as they are saved, which reduces aliasing from harsh waveforms.
 """
 
 
+# Standard Python libraries
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import time
+
 # Own modules
+import cache
+import effects
 import envelope
 import melody
+import profiler
+import sequencer
+import sound
+import stream
 import tone
+import wavetable
 
 
 OUTPUT_DIR = 'output'
+# Default sampling rate the sounds are saved at
+SAMPLING_RATE = 44100
+# Records the fingerprint of each recipe so unchanged sounds aren't rebuilt
+MANIFEST_FILENAME = 'manifest.json'
+# Modules whose source makes up the engine version
+ENGINE_MODULES = [cache, effects, envelope, melody, profiler, sequencer, sound, stream, tone, wavetable]
+
+
+def create_gameplay_audio(workers=1, force=False, profile_prefix=None, sampling_rate=SAMPLING_RATE,
+                          oversample=1):
+    """Create audio for the Kivy game app.
+
+    The sounds don't share any state, so they can be built at the same
+    time in separate processes. A summary of how long each sound took
+    and how many samples it produced is printed at the end.
+    Sounds whose recipe and engine haven't changed since they were last
+    built are skipped, unless force is True.
+    If a profile prefix is given, the time spent in each part of the engine
+    is printed for each sound and saved as PREFIX.json and as folded stacks
+    in PREFIX.folded for flame graph tools.
+    The sounds are rendered at sampling_rate * oversample and saved at
+    sampling_rate, so rendering at the rate they are saved at is quickest
+    and oversampling trades time for less aliasing.
+
+    Arguments:
+    workers -- number of processes to build the sounds in. Defaults to 1, None uses one per core
+    force -- whether every sound should be rebuilt. Defaults to False
+    profile_prefix -- path to save the profile to, without an extension. Defaults to None (no profiling)
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    # Each recipe with the files it saves, longest first so that it
+    # isn't left running on its own at the end
+    assets = [(make_bg_music, ["title.wav"]),
+              (make_frightened_sound, ["frightened.wav"]),
+              (make_death_sound, ["death.wav", "game_over.wav"]),
+              (make_start_sound, ["jingle.wav"]),
+              (make_retreating_sound, ["retreat.wav"]),
+              (make_eating_sound, ["chomp_high.wav", "chomp_low.wav"]),
+              (make_powerup_sound, ["power_up.wav"])]
+
+    start_time = time.time()
+    manifest = load_manifest()
+    engine_version = get_engine_version()
+
+    recipes = []
+    skipped = []
+    for recipe, filenames in assets:
+        fingerprint = get_fingerprint(recipe, engine_version, sampling_rate, oversample)
+        if force or not is_up_to_date(manifest, recipe.__name__, fingerprint, filenames):
+            recipes.append(recipe)
+            manifest[recipe.__name__] = {'fingerprint': fingerprint, 'files': filenames}
+        else:
+            skipped.append(recipe.__name__)
+
+    build = functools.partial(build_asset, profile=profile_prefix != None, sampling_rate=sampling_rate,
+                              oversample=oversample)
+    if workers == 1 or len(recipes) <= 1:
+        results = [build(recipe) for recipe in recipes]
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.map(build, recipes, chunksize=1)
+        pool.close()
+        pool.join()
+
+    # Only recorded once everything has built successfully
+    save_manifest(manifest)
+    print_build_summary(results, skipped, time.time() - start_time)
+
+    if profile_prefix != None:
+        # Each process profiled its own sounds, so put their records together
+        build_profile = profiler.Profiler()
+        for name, wall_time, sample_count, records in results:
+            build_profile.merge(records)
+        print_profile(build_profile)
+        build_profile.write_json(profile_prefix + '.json')
+        build_profile.write_folded(profile_prefix + '.folded')
+
+
+def build_asset(recipe, profile=False, sampling_rate=SAMPLING_RATE, oversample=1):
+    """Run an asset recipe and return its name, wall time, sample count and profile as a tuple.
+
+    The profile is the records from profiler.PROFILER for the recipe, which
+    is empty unless profile is True.
+
+    Arguments:
+    recipe -- function that makes and saves a sound, returning the number of samples saved
+    profile -- whether the engine should be profiled while the recipe runs. Defaults to False
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    profiler.PROFILER.reset()
+    if profile:
+        profiler.PROFILER.enable()
+
+    try:
+        start_time = time.time()
+        with profiler.PROFILER.section(recipe.__name__):
+            sample_count = recipe(sampling_rate, oversample)
+        wall_time = time.time() - start_time
+    finally:
+        profiler.PROFILER.disable()
+
+    return recipe.__name__, wall_time, sample_count, profiler.PROFILER.get_records()
+
+
+def print_build_summary(results, skipped, total_time):
+    """Print the time taken and samples produced by each asset recipe.
+
+    Arguments:
+    results -- list of (name, wall time, sample count, profile) tuples from build_asset
+    skipped -- list of names of recipes that were up to date
+    total_time -- the wall time of the whole build in seconds
+    """
+
+    for name, wall_time, sample_count, records in results:
+        print("%-24s %8.3fs %12d samples" % (name, wall_time, sample_count))
+    for name in skipped:
+        print("%-24s %9s" % (name, "skipped"))
+    total_samples = sum(result[2] for result in results)
+    print("%-24s %8.3fs %12d samples" % ("total", total_time, total_samples))
+
+
+def print_profile(build_profile):
+    """Print the calls, samples and self time of each part of the engine for each sound.
+
+    Arguments:
+    build_profile -- the Profiler holding the records of every sound
+    """
+
+    for section, functions in sorted(build_profile.get_breakdown().items()):
+        print("")
+        print("%-32s %8.3fs" % (section, functions[section]['seconds']))
+        # Slowest first, leaving out the section's own total
+        ordered = sorted(functions.items(), key=lambda item: item[1]['seconds'], reverse=True)
+        for name, totals in ordered:
+            if name != section:
+                print("  %-30s %8.3fs %8d calls %12d samples" %
+                      (name, totals['seconds'], totals['calls'], totals['samples']))
+
+
+def get_engine_version():
+    """Return a hash of the source of the modules used to render the sounds.
+
+    Any change to the engine could change how a sound is rendered, so it is
+    part of every recipe's fingerprint.
+    """
+
+    engine = hashlib.sha1()
+    for module in ENGINE_MODULES:
+        engine.update(inspect.getsource(module).encode('utf-8'))
+    return engine.hexdigest()
+
+
+def get_fingerprint(recipe, engine_version, sampling_rate=SAMPLING_RATE, oversample=1):
+    """Return a hash of an asset recipe, the engine version and the rates it is built at.
+
+    The recipes define all of their tones, envelopes, note strings, tempos and
+    effects in their own code, so the recipe's source covers all of its
+    parameters apart from the rates.
+
+    Arguments:
+    recipe -- function that makes and saves a sound
+    engine_version -- the hash of the engine from get_engine_version
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    fingerprint = hashlib.sha1(engine_version.encode('utf-8'))
+    fingerprint.update(inspect.getsource(recipe).encode('utf-8'))
+    fingerprint.update(("%d/%d" % (sampling_rate, oversample)).encode('utf-8'))
+    return fingerprint.hexdigest()
+
 
+def is_up_to_date(manifest, name, fingerprint, filenames):
+    """Return whether a recipe's files were built with the same fingerprint and still exist.
 
-def create_gameplay_audio():
-    """Create audio for the Kivy game app"""
-    make_bg_music()
-    make_eating_sound()
-    make_start_sound()
-    make_frightened_sound()
-    make_retreating_sound()
-    make_death_sound()
-    make_powerup_sound()
+    Arguments:
+    manifest -- dictionary of recipe names to their fingerprint and files from the last build
+    name -- the name of the recipe
+    fingerprint -- the recipe's current fingerprint
+    filenames -- the files the recipe saves
+    """
 
+    entry = manifest.get(name)
+    if entry == None or entry['fingerprint'] != fingerprint:
+        return False
+    return all(os.path.exists(os.path.join(OUTPUT_DIR, filename)) for filename in filenames)
 
-def make_bg_music():
-    """Produce a song to be used for the title screen."""
+
+def load_manifest():
+    """Return the manifest of the last build as a dictionary, or an empty one if there isn't one."""
+
+    path = os.path.join(OUTPUT_DIR, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(manifest):
+    """Save the manifest of recipe fingerprints and files next to the sounds."""
+
+    with open(os.path.join(OUTPUT_DIR, MANIFEST_FILENAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+
+def make_bg_music(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Produce a song to be used for the title screen.
+
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # The entire sound is release phase to make it fade out quickly
     short_sound_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0, 1)
@@ -46,19 +272,20 @@ def make_bg_music():
                        "D:3:16 D:3:16 D:3:16 "
                        "A:2:16 A:2:16 A:2:16 ")
 
-    first_part = music.create_melody(first_bar_string +
-                                     "E:3:16 E:3:16 E:3:16 "
-                                     "B:2:16 B:2:16 B:2:16 "
-                                     "D:3:16 D:3:16 D:3:16", main_instrument)
-
-    second_part = music.create_melody(first_bar_string +
-                                      "A:2:16 Ab:2:16 A:2:16 "
-                                      "Ab:2:8 Bb:2:16 B:2:16 "
-                                      "Bb:2:16 B:2:16 C:3:8 B:2:16", main_instrument)
-
-    extra_bit = music.create_melody("E:4:8 D:4:16", little_instrument)
-
-    background = music.create_melody("E:4:8. B:3:8. D:4:8. A:3:8. E:4:8. B:3:8. D:4:8.", background_instrument)
+    first_part_string = (first_bar_string +
+                         "E:3:16 E:3:16 E:3:16 "
+                         "B:2:16 B:2:16 B:2:16 "
+                         "D:3:16 D:3:16 D:3:16")
+    second_part_string = (first_bar_string +
+                          "A:2:16 Ab:2:16 A:2:16 "
+                          "Ab:2:8 Bb:2:16 B:2:16 "
+                          "Bb:2:16 B:2:16 C:3:8 B:2:16")
+    extra_bit_string = "E:4:8 D:4:16"
+    background_string = "E:4:8. B:3:8. D:4:8. A:3:8. E:4:8. B:3:8. D:4:8."
+
+    first_part = music.create_melody(first_part_string, main_instrument, render_rate)
+    second_part = music.create_melody(second_part_string, main_instrument, render_rate)
+    extra_bit = music.create_melody(extra_bit_string, little_instrument, render_rate)
 
     # Time that the extra bit should be played
     overlap_time = music.get_time_at_beat_of_bar(2, 5.5)
@@ -69,46 +296,66 @@ def make_bg_music():
     second_part.layer_sound_at_time(extra_bit, overlap_time)
 
     # Into repeats the first part 3 times then adds the second part (8 bars)
-    intro = first_part.copy()
+    # Lazy so that the repeats refer to the first part rather than copying it
+    intro = sound.Sound(sampling_rate=render_rate, lazy=True)
+    intro.append_sound(first_part)
     intro.repeat(2)
     intro.append_sound(second_part)
 
-    # The main section alternates between the two parts and has backing
-    main_part = first_part.copy()
-    main_part.append_sound(second_part)
-    main_part = main_part + background
-    main_part.layer_sound_at_time(background, music.get_time_at_bar(3))
-    # Main part plays 4 times in total
-    main_part.repeat(3)
+    # The main section alternates between the two parts and has backing,
+    # sequenced so that all the parts are mixed in one pass (4 bars)
+    main_sequence = sequencer.Sequencer(render_rate)
+    main_sequence.add_melody(music, first_part_string, main_instrument)
+    main_sequence.add_melody(music, extra_bit_string, little_instrument, 2, 5.5)
+    main_sequence.add_melody(music, second_part_string, main_instrument, 3)
+    main_sequence.add_melody(music, extra_bit_string, little_instrument, 4, 5.5)
+    main_sequence.add_melody(music, background_string, background_instrument)
+    main_sequence.add_melody(music, background_string, background_instrument, 3)
+    main_part = main_sequence.render()
+
+    # Combine the intro and main part to make the song as it is written,
+    # so the whole song is never held in memory
+    with sound.SoundWriter(OUTPUT_DIR, "title.wav", sampling_rate=sampling_rate, source_rate=render_rate) as song:
+        song.write_sound(intro)
+        # Main part plays 4 times in total
+        song.write_sound(main_part, repeats=4)
 
-    # Combine the intro and main part to make the song
-    song = intro.copy()
-    song.append_sound(main_part)
+    return song.samples_written
 
-    song.save(OUTPUT_DIR, "title.wav")
 
+def make_eating_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create sounds to be used for collecting a pellet.
 
-def make_eating_sound():
-    """Create sounds to be used for collecting a pellet."""
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # These are just arbitrary numbers that I played around with until it sounded good
     chomp_fenv = envelope.Envelope(envelope.EnvelopeType.frequency, -5, 0.5, 0.5, 0, 0)
     chomp_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0.5, 0.5)
 
-    # -17 makes tone play a low E
-    chomp_tone_high = tone.SquareTone(-17, 2000, 0.1, chomp_env, chomp_fenv)
-    chomp_high = chomp_tone_high.create_tone()
+    # -17 makes tone play a low E, and -22 plays the B below it
+    chomp_tone = tone.SquareTone(-17, 2000, 0.1, chomp_env, chomp_fenv)
+    chomp_high, chomp_low = chomp_tone.create_tones([-17, -22], chomp_tone.seconds, sampling_rate=render_rate)
+
+    high_file = chomp_high.save(OUTPUT_DIR, "chomp_high.wav", sampling_rate=sampling_rate)
+    low_file = chomp_low.save(OUTPUT_DIR, "chomp_low.wav", sampling_rate=sampling_rate)
 
-    # -22 makes tone play the B below the previous E
-    chomp_tone_low = tone.SquareTone(-22, 2000, 0.1, chomp_env, chomp_fenv)
-    chomp_low = chomp_tone_low.create_tone()
+    return high_file.samples_written + low_file.samples_written
 
-    chomp_high.save(OUTPUT_DIR, "chomp_high.wav")
-    chomp_low.save(OUTPUT_DIR, "chomp_low.wav")
 
+def make_start_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create a sound to be used when the game begins.
 
-def make_start_sound():
-    """Create a sound to be used when the game begins."""
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # Entire tone is release phase to make it fade out quickly
     jingle_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0, 1)
@@ -117,13 +364,22 @@ def make_start_sound():
     # 180bpm, 6/8 compound time signature to emulate triplets
     music = melody.Melody(180, '6/8')
     jingle = music.create_melody("C:2:8 C:2:16 D:2:8 C:2:16 "
-                                 "Eb:2:8 C:2:4 F#:2:8. F#:2:8 G:2:2", instrument)
+                                 "Eb:2:8 C:2:4 F#:2:8. F#:2:8 G:2:2", instrument, render_rate)
+
+    jingle_file = jingle.save(OUTPUT_DIR, "jingle.wav", sampling_rate=sampling_rate)
+
+    return jingle_file.samples_written
 
-    jingle.save(OUTPUT_DIR, "jingle.wav")
 
+def make_death_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create a sound to be played upon death and game over.
 
-def make_death_sound():
-    """Create a sound to be played upon death and game over."""
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # Entire tone is release phase to make it fade out quickly
     death_env = envelope.Envelope(envelope.EnvelopeType.amplitude, 0, 0, 0, 0, 1)
@@ -131,30 +387,48 @@ def make_death_sound():
 
     # 180bpm, 6/8 compound time signature to emulate triplets
     music = melody.Melody(180, '6/8')
-    death = music.create_melody("F#:2:8. F#:2:8 G:2:8. F:2:16 Eb:2:8 D:2:16 C:2:4.", instrument)
-    bong = music.create_melody("C:3:2", instrument)
+    death = music.create_melody("F#:2:8. F#:2:8 G:2:8. F:2:16 Eb:2:8 D:2:16 C:2:4.", instrument, render_rate)
+    bong = music.create_melody("C:3:2", instrument, render_rate)
 
     game_over = death.copy()
     game_over.append_sound(bong)
 
-    death.save(OUTPUT_DIR, "death.wav")
-    game_over.save(OUTPUT_DIR, "game_over.wav")
+    death_file = death.save(OUTPUT_DIR, "death.wav", sampling_rate=sampling_rate)
+    game_over_file = game_over.save(OUTPUT_DIR, "game_over.wav", sampling_rate=sampling_rate)
+
+    return death_file.samples_written + game_over_file.samples_written
 
 
-def make_powerup_sound():
-    """Create a sound to be played when a power-up is collected."""
+def make_powerup_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create a sound to be played when a power-up is collected.
+
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # All attack to make sound get higher
     power_env = envelope.Envelope(envelope.EnvelopeType.frequency, 0, 1, 0, 0, 0)
     # 31 is a high E
     power_tone = tone.SineTone(31, 2000, 0.25, None, power_env)
-    power_sound = power_tone.create_tone()
+    power_sound = power_tone.create_tone(sampling_rate=render_rate)
+
+    power_file = power_sound.save(OUTPUT_DIR, "power_up.wav", sampling_rate=sampling_rate)
+
+    return power_file.samples_written
+
 
-    power_sound.save(OUTPUT_DIR, "power_up.wav")
+def make_frightened_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create a sound to be played when the enemy is frightened.
 
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
 
-def make_frightened_sound():
-    """Create a sound to be played when the enemy is frightened."""
+    render_rate = sampling_rate * oversample
 
     # Values found through experimentation
     frightened_fenv = envelope.Envelope(envelope.EnvelopeType.frequency, -3, 0.25, 0.5, 0, 0.25)
@@ -166,27 +440,50 @@ def make_frightened_sound():
     notes = "E:5:8 B:4:8 D:5:8 A:4:8 "
     # So that notes can be used more than once (arbitrary number)
     notes *=10
-    frightened_sound = music.create_shuffled_melody(notes, frightened_tone)
+    frightened_sound = music.create_shuffled_melody(notes, frightened_tone, render_rate)
     # Sound should last a while (arbitrary number)
     frightened_sound.repeat(5)
 
-    frightened_sound.save(OUTPUT_DIR, "frightened.wav")
+    frightened_file = frightened_sound.save(OUTPUT_DIR, "frightened.wav", sampling_rate=sampling_rate)
 
+    return frightened_file.samples_written
 
-def make_retreating_sound():
-    """Create a sound to be played when the enemy is retreating."""
+
+def make_retreating_sound(sampling_rate=SAMPLING_RATE, oversample=1):
+    """Create a sound to be played when the enemy is retreating.
+
+    Arguments:
+    sampling_rate -- the sampling rate the sounds are saved at. Defaults to SAMPLING_RATE
+    oversample -- how many times higher the sampling rate the sounds are rendered at is. Defaults to 1
+    """
+
+    render_rate = sampling_rate * oversample
 
     # All attack phase makes sound get higher
     retreat_fenv = envelope.Envelope(envelope.EnvelopeType.frequency, 0, 1, 0, 0, 0)
     # 19 gives a high E
     retreat_tone = tone.SineTone(19, 2000, 1.5, None, retreat_fenv)
 
-    retreat_sound = retreat_tone.create_tone()
-    # Values sounded good through experimentation
-    retreat_sound.feedback_echo(5000, 0.6)
+    retreat_sound = retreat_tone.create_tone(sampling_rate=render_rate)
+    # Values sounded good through experimentation, the delay was 5000 samples at 44.1kHz
+    retreat_sound.feedback_echo(5000 * render_rate // 44100, 0.6, in_samples=True)
+
+    retreat_file = retreat_sound.save(OUTPUT_DIR, "retreat.wav", sampling_rate=sampling_rate)
 
-    retreat_sound.save(OUTPUT_DIR, "retreat.wav")
+    return retreat_file.samples_written
 
 
 if __name__ == '__main__':
-    create_gameplay_audio()
+    parser = argparse.ArgumentParser(description="Create audio for the Kivy game app.")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="number of processes to build the sounds in, 0 for one per core")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="rebuild every sound, even if it hasn't changed")
+    parser.add_argument('-p', '--profile', metavar='PREFIX',
+                        help="profile the engine and save it to PREFIX.json and PREFIX.folded")
+    parser.add_argument('-r', '--rate', type=int, default=SAMPLING_RATE,
+                        help="sampling rate to save the sounds at, such as 22050 for mobile")
+    parser.add_argument('-o', '--oversample', type=int, default=1,
+                        help="render at this many times the rate and decimate when saving")
+    args = parser.parse_args()
+    create_gameplay_audio(args.workers or None, args.force, args.profile, args.rate, args.oversample)
@@ -5,14 +5,45 @@ melodies by parsing strings.
 
  Classes:
  Melody -- class for creating melodies
+ ScoreError(ValueError) -- error raised when a note string can't be parsed
  """
 
 
-# Standard Python library
+# Standard Python libraries
+import copy
 import random
+import re
 
-# Own module
+# Additional libraries
+import numpy
+
+# Own modules
+import cache
+import profiler
 import sound
+import stream
+
+
+# Maximum size of rendered notes kept for reuse in bytes
+NOTE_CACHE_SIZE = 32 * 1024 * 1024
+# Maximum number of compiled scores kept for reuse
+SCORE_CACHE_SIZE = 256
+
+# Number of semitones each note name is from A
+NOTE_NUMBERS = {'C': -9, 'C#': -8, 'Db': -8, 'D': -7, 'D#': -6, 'Eb': -6,
+                'E': -5, 'F': -4, 'F#': -3, 'Gb': -3, 'G': -2, 'G#': -1,
+                'Ab': -1, 'A': 0, 'A#': 1, 'Bb': 1, 'B': 2}
+# 4 will be the octave of middle C, as in most audio packages
+BASE_OCTAVE = 4
+# 12 semitones in an octave
+NOTES_IN_OCTAVE = 12
+
+# A whole note in the form notename:octave:notetype, with a '.' after notetype for dotted notes
+NOTE_PATTERN = re.compile(r'([A-G][#b]?):(-?\d+):(\d+(?:\.\d+)?)(\.?)\Z')
+# Each event of a compiled score is a note number, start and length in samples,
+# and the length in seconds that the length in samples was rounded from
+SCORE_DTYPE = [('note', numpy.int32), ('start', numpy.int64), ('length', numpy.int64),
+               ('seconds', numpy.float64)]
 
 
 class Melody(object):
@@ -25,11 +56,22 @@ class Melody(object):
     Public Methods:
     create_melody -- creates a melody in a Sound object
     create_shuffled_melody -- creates a shuffled melody in a Sound object
+    stream_melody -- returns a stream.FrameStream that generates a melody as frames are read
+    compile_score -- returns the events of a note string as an array
     get_time_at_beat -- returns the time at the given beat number
     get_time_at_bar -- returns the time at the given bar
     get_time_at_beat_of_bar -- returns the time at the given beat of the given bar
+
+    Public Fields and Properties:
+    note_cache -- cache.LRUCache of rendered notes, shared by all melodies unless replaced
+    score_cache -- cache.LRUCache of compiled scores, shared by all melodies unless replaced
     """
 
+    # Notes are usually repeated across melodies played by the same instrument
+    note_cache = cache.LRUCache(max_bytes=NOTE_CACHE_SIZE)
+    # Melodies are often made from the same strings more than once
+    score_cache = cache.LRUCache(SCORE_CACHE_SIZE)
+
     def __init__(self, beats_per_minute, time_sig):
         """Intialise the fields.
 
@@ -98,27 +140,35 @@ class Melody(object):
         self.__beats_per_minute = value
         self.__beat_length = SECONDS_PER_MINUTE / self.beats_per_minute
 
-    def create_melody(self, note_string, tone):
+    @profiler.measure('Melody.create_melody')
+    def create_melody(self, note_string, tone, sampling_rate=44100):
         """Create a melody from a string and return it as a Sound object
 
         This method creates a melody from a string and returns it as a
         Sound object. The notes in the string should be in the form
         notename:octave:notetype and each note should be separated by a space.
         The Tone object used for the melody can be seen as the 'instrument'.
+        Each note is rendered with a tone.Voice, so the tone isn't changed and
+        can be used to create other melodies at the same time.
+        Rendered notes are kept in note_cache, so a note that has already been
+        played by the same instrument is copied rather than generated again.
 
         Arguments:
         tone -- Tone object that the melody will be made from
         note_string --  string in the format notename:octave:notetype, separated by spaces
+        sampling_rate -- the sampling rate to render the melody at. Defaults to 44100
         """
 
-        melody = sound.Sound()
-        note_values = self.__parse_notes(note_string)
-        for note in note_values:
-            tone.note, tone.seconds = note
-            tone.add_tone(melody)
+        melody = sound.Sound(sampling_rate=sampling_rate)
+        score = self.compile_score(note_string, melody.sampling_rate)
+        # One voice is reused for every note
+        voice = tone.get_voice()
+        for note, seconds in zip(score['note'].tolist(), score['seconds'].tolist()):
+            voice.set(note, seconds)
+            melody.append_sound(self.__render_note(tone, voice, melody.sampling_rate))
         return melody
 
-    def create_shuffled_melody(self, note_string, tone):
+    def create_shuffled_melody(self, note_string, tone, sampling_rate=44100):
         """Shuffle a string to create a random melody and return it as a Sound object.
 
         This method shuffles a string of notes and created a melody which is returned as a
@@ -130,12 +180,62 @@ class Melody(object):
         Arguments:
         tone -- Tone object that the melody will be made from
         note_string --  string to be shuffled in the format notename:octave:notetype, separated by spaces
+        sampling_rate -- the sampling rate to render the melody at. Defaults to 44100
         """
 
         note_list = note_string.split()
         random.shuffle(note_list)
         shuffled_note_string = ' '.join(note_list)
-        return self.create_melody(shuffled_note_string, tone)
+        return self.create_melody(shuffled_note_string, tone, sampling_rate)
+
+    def stream_melody(self, note_string, tone, sampling_rate=44100, frame_size=stream.FRAME_SIZE):
+        """Return a stream.FrameStream that generates a melody as its frames are read.
+
+        This method takes the same note string as create_melody, but notes are
+        only generated a frame at a time as the stream is read, so the melody
+        can be played while it is being generated. Notes in note_cache are
+        read from the cache. The stream uses a copy of the tone, so the tone
+        can be used elsewhere while it is being streamed.
+
+        Arguments:
+        note_string -- string in the format notename:octave:notetype, separated by spaces
+        tone -- Tone object that the melody will be made from
+        sampling_rate -- the sampling rate to generate the melody at. Defaults to 44100
+        frame_size -- the number of samples in each frame. Defaults to stream.FRAME_SIZE
+        """
+
+        score = self.compile_score(note_string, sampling_rate)
+        note_values = zip(score['note'].tolist(), score['seconds'].tolist())
+        blocks = self.__generate_blocks(note_values, copy.copy(tone), sampling_rate, frame_size)
+        return stream.FrameStream(blocks, frame_size)
+
+    def compile_score(self, note_string, sampling_rate=44100):
+        """Return the events of a note string as a numpy array.
+
+        This method parses a string of notes given in the form
+        notename:octave:notetype, separated by spaces. Octave number 4 is
+        middle C. Dotted notes can be formed by adding '.' after notetype.
+        Each event has the note number for frequency conversion, the sample
+        the note starts at, its length in samples and its length in seconds,
+        which can be read from the array by those names (see SCORE_DTYPE).
+        Compiled scores are cached by the string, tempo, time signature and
+        sampling rate, so parsing the same string again is free. The returned
+        array is shared and so is read-only.
+        A ScoreError giving the position of the first bad note is raised if
+        the string can't be parsed.
+
+        Arguments:
+        note_string -- string in the format notename:octave:notetype, separated by spaces
+        sampling_rate -- the sampling rate used for the starts and lengths. Defaults to 44100
+        """
+
+        key = (note_string, self.beats_per_minute, self.time_sig, sampling_rate)
+        score = self.score_cache.get(key)
+        if score is None:
+            score = self.__compile_score(note_string, sampling_rate)
+            score.flags.writeable = False
+            self.score_cache.put(key, score)
+        return score
 
     def get_time_at_beat(self, beat_number):
         """Return the time in seconds of a the start of given beat."""
@@ -154,74 +254,111 @@ class Melody(object):
 
         return self.get_time_at_bar(bar_number) + self.get_time_at_beat(beat_number)
 
-    def __parse_notes(self, note_string):
-        """Parse the note string and return the note values and lengths.
-
-        This method parses a string of notes given in the form
-        notename:octave:notetype, separated by spaces into numbers to be
-        used for frequency conversion. Octave number 4 is middle C.
-        Dotted notes can be formed by adding '.' after notetype.
-        This method returns a list of tuples containing the note value and note
-        length.
-
-        Arguments:
-        note_string -- string in the format notename:octave:notetype, separated by spaces.
-        """
+    def __render_note(self, tone, voice, sampling_rate):
+        """Return the voice played by the tone as a Sound, using the note cache if possible."""
 
-        note_values = []
-        for note in note_string.split(' '):
-            note_letter, octave, length = note.split(':')
-            note_length = self.__get_note_length(length)
-            note = self.__get_note_number(note_letter, int(octave))
-            note_values.append((note, note_length))
+        key = tone.get_render_key(sampling_rate, voice)
+        if key != None:
+            note = self.note_cache.get(key)
+            if note != None:
+                return note
 
-        return note_values
+        note = sound.Sound(sampling_rate=sampling_rate)
+        tone.add_tone(note, voice)
+        if key != None:
+            self.note_cache.put(key, note, len(note.samples) * note.samples.itemsize)
+        return note
 
-    def __get_note_length(self, length):
-        """Return the length of the note in seconds.
+    def __generate_blocks(self, note_values, tone, sampling_rate, block_size):
+        """Generate the samples of each note in turn as numpy arrays of up to block_size samples."""
+
+        # Each note's blocks are generated before the next note, so one voice can be reused
+        voice = tone.get_voice()
+        for note, seconds in note_values:
+            voice.set(note, seconds)
+            key = tone.get_render_key(sampling_rate, voice)
+            cached_note = self.note_cache.get(key) if key != None else None
+            if cached_note != None:
+                blocks = cached_note.iter_chunks(block_size)
+            else:
+                blocks = tone.generate_blocks(sampling_rate, block_size, voice)
+            for block in blocks:
+                yield block
+
+    def __compile_score(self, note_string, sampling_rate):
+        """Parse the note string into an array of events for compile_score.
+
+        Scores are made of the same few notes repeated, so each different
+        note is only parsed once into a table of events, which the score is
+        then indexed from.
+        """
 
-        This method converts the relative musical length of a note into
-        an absolute length in seconds. It returns the length as a float.
-        A '.' can be added to the end of the length string for dotted notes.
+        tokens = note_string.split()
+        unique_tokens = list(set(tokens))
+        table = numpy.zeros(len(unique_tokens), dtype=SCORE_DTYPE)
+        try:
+            for i, token in enumerate(unique_tokens):
+                # The position is found below if the note can't be parsed
+                table[i] = self.__parse_note(token, sampling_rate, -1)
+        except ScoreError:
+            # Parse the notes in order to report the first bad note and where it is
+            for match in re.finditer(r'\S+', note_string):
+                self.__parse_note(match.group(), sampling_rate, match.start())
+            raise
+
+        table_indices = dict((token, i) for i, token in enumerate(unique_tokens))
+        score = table[numpy.array([table_indices[token] for token in tokens], dtype=int)]
+        score['start'][1:] = numpy.cumsum(score['length'][:-1])
+        return score
+
+    def __parse_note(self, note, sampling_rate, position):
+        """Return the event for a single note as a tuple in the order of SCORE_DTYPE.
+
+        The start of the event is 0. A ScoreError is raised if the note can't
+        be parsed.
 
         Arguments:
-        length -- the musical length of the note as a string
+        note -- the note as a string in the format notename:octave:notetype
+        sampling_rate -- the sampling rate used for the length in samples
+        position -- the index of the note in the note string, for errors
         """
 
-        # Process dotted notes
-        if length.endswith('.'):
-            length.strip('.')
-            note_length = self.default_note_type / float(length) * self.beat_length
+        match = NOTE_PATTERN.match(note)
+        if match == None:
+            raise ScoreError("Notes should be notename:octave:notetype", note, position)
+        note_letter, octave, length, dot = match.groups()
+        if note_letter not in NOTE_NUMBERS:
+            raise ScoreError("Unknown note name", note, position)
+        if float(length) <= 0:
+            raise ScoreError("Note type should be greater than 0", note, position)
+
+        note_number = NOTE_NUMBERS[note_letter] + NOTES_IN_OCTAVE * (int(octave) - BASE_OCTAVE)
+        seconds = self.default_note_type / float(length) * self.beat_length
+        if dot:
             # Because a dotted note is 1.5 times the length of original
-            note_length *= 1.5
-        else:
-            note_length = self.default_note_type / float(length) * self.beat_length
+            seconds *= 1.5
+        # Truncated like sound.Sound.convert_secs_to_samples
+        return note_number, 0, int(sampling_rate * seconds), seconds
 
-        return note_length
 
-    def __get_note_number(self, note_letter, octave):
-        """Return the number of a note for frequency calculation.
+class ScoreError(ValueError):
 
-        This method converts a note letter and octave into a number to be
-        used for calculating frequency.
-
-        Arguments:
-        note_letter -- note letter as a string
-        octave -- octave of the note as a string (or int)
-        """
-
-        notes = {'C': -9, 'C#': -8, 'Db': -8, 'D': -7, 'D#': -6, 'Eb': -6,
-                 'E': -5, 'F': -4, 'F#': -3, 'Gb': -3, 'G': -2, 'G#': -1,
-                 'Ab': -1, 'A': 0, 'A#': 1, 'Bb': 1, 'B': 2}
-
-        # 4 will be the octave of middle C, as in most audio packages
-        BASE_OCTAVE = 4
-        # 12 semitones in an octave
-        NOTES_IN_OCTAVE = 12
-        octave_shift = NOTES_IN_OCTAVE * (int(octave) - BASE_OCTAVE)
-        note = notes[note_letter] + octave_shift
-        return note
+    """Error raised when a note string can't be parsed.
 
+    Public Fields and Properties:
+    note -- the note that couldn't be parsed
+    position -- the index of the note in the note string
+    """
 
+    def __init__(self, message, note, position):
+        """Initialise the fields.
 
+        Arguments:
+        message -- description of what is wrong with the note
+        note -- the note that couldn't be parsed
+        position -- the index of the note in the note string
+        """
 
+        super(ScoreError, self).__init__("%s: '%s' at position %d" % (message, note, position))
+        self.note = note
+        self.position = position
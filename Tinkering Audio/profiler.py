@@ -0,0 +1,241 @@
+"""Contain a class and decorator for measuring where rendering time goes.
+
+This module contains a profiler that records the number of calls, samples
+processed and time taken by the parts of the engine that are decorated
+with measure. Measurements are grouped by the stack of measured calls they
+were made in, so that time can be broken down by asset and exported as
+JSON or as folded stacks for flame graph tools.
+Profiling is off unless it is enabled, and measured functions only check
+a flag when it is off.
+
+Classes:
+Profiler -- class for recording measurements
+
+Functions:
+measure -- decorator that measures calls to a function with PROFILER
+"""
+
+
+# Standard Python libraries
+import contextlib
+import functools
+import inspect
+import json
+import time
+
+
+class Profiler(object):
+
+    """Contain methods and fields for recording measurements of calls.
+
+    This class keeps a stack of the measured calls that are in progress.
+    When a call finishes, its calls, samples, total time and self time
+    (total time minus the time of measured calls made inside it) are added
+    to the record for its stack.
+
+    Public Methods:
+    enable -- starts recording measurements
+    disable -- stops recording measurements
+    reset -- forgets all measurements
+    section -- context manager that measures a named section, such as an asset
+    start -- starts measuring a call
+    stop -- finishes measuring the most recent call
+    get_records -- returns the measurements for each stack
+    merge -- adds measurements from another profiler, such as one in another process
+    get_breakdown -- returns the measurements of each function grouped by top-level section
+    write_json -- saves the measurements as JSON
+    write_folded -- saves the self times as folded stacks for flame graph tools
+
+    Public Fields and Properties:
+    enabled -- whether measurements are being recorded
+    """
+
+    def __init__(self):
+        """Initialise the fields."""
+
+        self.enabled = False
+        # Tuple of names in a stack to [calls, samples, seconds, self seconds]
+        self.__records = {}
+        # Each frame is [name, start time, time of measured calls inside it]
+        self.__stack = []
+
+    def enable(self):
+        """Start recording measurements."""
+
+        self.enabled = True
+
+    def disable(self):
+        """Stop recording measurements."""
+
+        self.enabled = False
+
+    def reset(self):
+        """Forget all measurements."""
+
+        self.__records = {}
+        self.__stack = []
+
+    @contextlib.contextmanager
+    def section(self, name):
+        """Measure everything done inside a with statement under the given name.
+
+        Arguments:
+        name -- the name of the section, such as the name of an asset
+        """
+
+        if not self.enabled:
+            yield
+            return
+
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def start(self, name):
+        """Start measuring a call with the given name."""
+
+        self.__stack.append([name, time.time(), 0.0])
+
+    def stop(self, samples=0, calls=1):
+        """Finish measuring the most recent call and record it.
+
+        Arguments:
+        samples -- the number of samples the call processed. Defaults to 0
+        calls -- the number of calls to record. Defaults to 1
+        """
+
+        stack_key = tuple(frame[0] for frame in self.__stack)
+        name, start_time, child_time = self.__stack.pop()
+        elapsed = time.time() - start_time
+        if self.__stack:
+            self.__stack[-1][2] += elapsed
+
+        record = self.__records.setdefault(stack_key, [0, 0, 0.0, 0.0])
+        record[0] += calls
+        record[1] += samples
+        record[2] += elapsed
+        record[3] += elapsed - child_time
+
+    def get_records(self):
+        """Return a dictionary of stacks to their [calls, samples, seconds, self seconds]."""
+
+        return dict((stack, list(record)) for stack, record in self.__records.items())
+
+    def merge(self, records):
+        """Add the records from another profiler's get_records to this profiler's."""
+
+        for stack, other in records.items():
+            record = self.__records.setdefault(tuple(stack), [0, 0, 0.0, 0.0])
+            for i in xrange(len(record)):
+                record[i] += other[i]
+
+    def get_breakdown(self):
+        """Return the measurements of each function grouped by top-level section.
+
+        This returns a dictionary of section names, such as asset names, to
+        dictionaries of function names to their total calls, samples and
+        self seconds within that section. Each section's own entry holds the
+        total time of the section.
+        """
+
+        breakdown = {}
+        for stack, (calls, samples, seconds, self_seconds) in self.__records.items():
+            functions = breakdown.setdefault(stack[0], {})
+            totals = functions.setdefault(stack[-1], {'calls': 0, 'samples': 0, 'seconds': 0.0})
+            totals['calls'] += calls
+            totals['samples'] += samples
+            if len(stack) == 1:
+                # The section's total time rather than its self time
+                totals['seconds'] += seconds
+            else:
+                totals['seconds'] += self_seconds
+        return breakdown
+
+    def write_json(self, path):
+        """Save each stack's measurements and the breakdown by section as JSON."""
+
+        stacks = [{'stack': list(stack), 'calls': calls, 'samples': samples,
+                   'seconds': seconds, 'self_seconds': self_seconds}
+                  for stack, (calls, samples, seconds, self_seconds) in sorted(self.__records.items())]
+        with open(path, 'w') as json_file:
+            json.dump({'stacks': stacks, 'breakdown': self.get_breakdown()}, json_file,
+                      indent=4, sort_keys=True)
+
+    def write_folded(self, path):
+        """Save the self time of each stack in microseconds as folded stacks.
+
+        Each line is the names in the stack separated by semicolons, followed
+        by a space and the time, which is the format read by flame graph tools.
+        """
+
+        with open(path, 'w') as folded_file:
+            for stack, record in sorted(self.__records.items()):
+                microseconds = int(record[3] * 1000000)
+                if microseconds > 0:
+                    folded_file.write("%s %d\n" % (";".join(stack), microseconds))
+
+
+# Measurements from measure are recorded here
+PROFILER = Profiler()
+
+
+def measure(name, samples=None):
+    """Return a decorator that measures calls to a function with PROFILER.
+
+    When PROFILER is disabled, the decorated function only checks the flag
+    before calling the original function. Generator functions are measured
+    for the time spent producing each value, rather than creating the
+    generator.
+
+    Arguments:
+    name -- the name the calls are recorded under
+    samples -- function that is given the call's arguments and returns the
+               number of samples it processes. Defaults to None (no samples)
+    """
+
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not PROFILER.enabled:
+                    return func(*args, **kwargs)
+                count = samples(*args, **kwargs) if samples != None else 0
+                return _measure_generator(name, func(*args, **kwargs), count)
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not PROFILER.enabled:
+                    return func(*args, **kwargs)
+                count = samples(*args, **kwargs) if samples != None else 0
+                PROFILER.start(name)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    PROFILER.stop(count)
+        return wrapper
+
+    return decorator
+
+
+def _measure_generator(name, generator, samples):
+    """Yield the values of a generator, measuring the time taken to produce each.
+
+    The call and its samples are recorded with the first value. The time
+    is recorded even if the generator raises an exception, so that the
+    stack of measured calls is left as it was.
+    """
+
+    calls = 1
+    while True:
+        PROFILER.start(name)
+        try:
+            value = next(generator)
+        except StopIteration:
+            return
+        finally:
+            PROFILER.stop(samples, calls)
+        calls = 0
+        samples = 0
+        yield value
@@ -0,0 +1,256 @@
+"""Contain classes for sequencing notes played by many instruments at once.
+
+This module contains a class that renders a timeline of notes, played by
+any number of instruments, into one sound. The notes are mixed a block at
+a time in time order, so each block of the output is only written once,
+however many notes overlap it.
+
+Classes:
+Sequencer -- class for rendering a timeline of notes
+PlayingNote -- class for a note that is being rendered
+"""
+
+
+# Additional libraries
+import numpy
+
+# Own modules
+import melody
+import profiler
+import sound
+import tone
+
+
+class Sequencer(object):
+
+    """Contain methods and fields for rendering a timeline of notes.
+
+    This class stores events, each a note played by an instrument at a time
+    for a duration. When rendered, the output is mixed a block at a time.
+    Each note starts generating when the block it starts in is mixed, and is
+    mixed into the blocks it overlaps as it is generated, so only the notes
+    that are playing are kept in memory.
+    Times can be worked out with the timing methods of melody.Melody, such
+    as get_time_at_beat_of_bar, and whole note strings can be added with
+    add_melody.
+
+    Public Methods:
+    add_event -- adds a note played by an instrument at a time
+    add_melody -- adds each note of a note string as an event
+    clear -- removes every event
+    get_length -- returns the length of the output in samples
+    generate_blocks -- generates the mixed output a block at a time
+    render -- renders the whole timeline into a Sound
+
+    Public Fields and Properties:
+    sampling_rate -- the sampling rate of the output
+    block_size -- the number of samples mixed at once
+    clip_mode -- how the rendered Sound is kept in range when saved as a sound.ClipMode
+    note_cache -- cache.LRUCache of rendered notes, or None to render every note
+    """
+
+    def __init__(self, sampling_rate=44100, block_size=tone.BLOCK_SIZE, clip_mode=None):
+        """Initialise the fields.
+
+        Arguments:
+        sampling_rate -- the sampling rate of the output. Defaults to 44100
+        block_size -- the number of samples mixed at once. Defaults to tone.BLOCK_SIZE
+        clip_mode -- how the rendered Sound is kept in range when saved as a sound.ClipMode. Defaults to None (hard)
+        """
+
+        self.sampling_rate = sampling_rate
+        self.block_size = block_size
+        self.clip_mode = clip_mode
+        # Shared with melodies, as the same instruments often play the same notes
+        self.note_cache = melody.Melody.note_cache
+        # Each event is (start sample, order added, instrument, note, duration in seconds)
+        self.__events = []
+
+    def add_event(self, seconds, instrument, note, duration):
+        """Add a note played by an instrument at the given time.
+
+        The instrument isn't changed and is only read when the note starts
+        being rendered.
+
+        Arguments:
+        seconds -- the time the note starts at
+        instrument -- the Tone that plays the note
+        note -- the note number, as used by Tone
+        duration -- the length of the note in seconds
+        """
+
+        start = int(self.sampling_rate * seconds)
+        self.__add_event(start, instrument, note, duration)
+
+    def add_melody(self, music, note_string, instrument, bar=1, beat=1):
+        """Add each note of a note string as an event, starting at a beat of a bar.
+
+        The notes are timed by the tempo and time signature of music in the
+        same way as melody.Melody.create_melody, so they start at the same
+        samples as they would in the melody.
+
+        Arguments:
+        music -- melody.Melody whose tempo and time signature are used
+        note_string -- string in the format notename:octave:notetype, separated by spaces
+        instrument -- the Tone that plays the notes
+        bar -- the bar the first note starts in. Defaults to 1
+        beat -- the beat of the bar the first note starts on. Defaults to 1
+        """
+
+        offset = int(self.sampling_rate * music.get_time_at_beat_of_bar(bar, beat))
+        score = music.compile_score(note_string, self.sampling_rate)
+        for note, start, length, seconds in score.tolist():
+            self.__add_event(offset + start, instrument, note, seconds)
+
+    def clear(self):
+        """Remove every event."""
+
+        self.__events = []
+
+    def get_length(self):
+        """Return the length of the output in samples, up to the end of the last note."""
+
+        return max([start + int(self.sampling_rate * duration)
+                    for start, order, instrument, note, duration in self.__events] or [0])
+
+    def generate_blocks(self):
+        """Generate the mixed output as numpy arrays of up to block_size samples.
+
+        The blocks are mixed as 32-bit floats and aren't clipped, so they
+        should be converted with sound.quantise when they are exported.
+        """
+
+        length = self.get_length()
+        events = sorted(self.__events)
+        next_event = 0
+        playing = []
+        # Voices of finished notes are reused for the next notes
+        voice_pool = tone.VoicePool()
+        for block_start in xrange(0, length, self.block_size):
+            block = numpy.zeros(min(self.block_size, length - block_start), dtype=numpy.float32)
+            block_end = block_start + len(block)
+
+            # Start every note that begins in this block
+            while next_event < len(events) and events[next_event][0] < block_end:
+                start, order, instrument, note, duration = events[next_event]
+                voice = voice_pool.acquire(note, duration)
+                playing.append(PlayingNote(instrument, voice, start, self.sampling_rate, self.block_size,
+                                           self.note_cache))
+                next_event += 1
+
+            for playing_note in playing:
+                playing_note.mix_into(block, block_start)
+                if playing_note.finished:
+                    voice_pool.release(playing_note.voice)
+            playing = [playing_note for playing_note in playing if not playing_note.finished]
+            yield block
+
+    @profiler.measure('Sequencer.render', lambda self: self.get_length())
+    def render(self):
+        """Render every event into a new Sound and return it.
+
+        The Sound is allocated at its full length first, and each block is
+        written to it once it has been mixed.
+        """
+
+        output = sound.Sound(sampling_rate=self.sampling_rate, clip_mode=self.clip_mode,
+                             samples=numpy.zeros(self.get_length(), dtype=numpy.float32))
+        index = 0
+        for block in self.generate_blocks():
+            output.combine_samples_at_index(block, index)
+            index += len(block)
+        return output
+
+    def __add_event(self, start, instrument, note, duration):
+        """Store an event, keeping the order events were added for notes that start together."""
+
+        self.__events.append((start, len(self.__events), instrument, note, duration))
+
+
+class PlayingNote(object):
+
+    """Contain methods and fields for a note that is being rendered.
+
+    This class generates the samples of a tone.Voice played by an instrument
+    and mixes them into the blocks of the output that they overlap. The
+    instrument isn't changed, so it can play other notes at the same time.
+    If a note cache is given, the note is read from it if it has already
+    been rendered, or added to it once it has.
+
+    Public Methods:
+    mix_into -- adds the note's samples to a block of the output
+
+    Public Fields and Properties:
+    voice -- the tone.Voice being rendered
+    position -- the sample of the output the next sample of the note is mixed into
+    finished -- whether every sample of the note has been mixed
+    """
+
+    __slots__ = ('voice', 'position', 'finished', '__note_cache', '__sampling_rate', '__key',
+                 '__generated', '__blocks', '__pending')
+
+    def __init__(self, instrument, voice, start, sampling_rate, block_size, note_cache=None):
+        """Initialise the fields.
+
+        Arguments:
+        instrument -- the Tone that plays the note
+        voice -- the tone.Voice holding the note and duration, which shouldn't change until finished
+        start -- the sample of the output the note starts at
+        sampling_rate -- the sampling rate of the output
+        block_size -- the number of samples generated at once
+        note_cache -- cache.LRUCache of rendered notes, as used by melody.Melody. Defaults to None (no cache)
+        """
+
+        self.voice = voice
+        self.position = start
+        self.finished = False
+        self.__note_cache = note_cache
+        self.__sampling_rate = sampling_rate
+        # Blocks are only kept to be cached once the note is finished
+        self.__generated = None
+
+        self.__key = instrument.get_render_key(sampling_rate, voice) if note_cache != None else None
+        cached_note = note_cache.get(self.__key) if self.__key != None else None
+        if cached_note != None:
+            self.__blocks = cached_note.iter_chunks(block_size)
+        else:
+            self.__blocks = instrument.generate_blocks(sampling_rate, block_size, voice)
+            if self.__key != None:
+                self.__generated = []
+        self.__pending = None
+        self.__next_block()
+
+    def mix_into(self, block, block_start):
+        """Add the note's samples that overlap a block of the output to it.
+
+        Arguments:
+        block -- numpy array of the output's samples to add to
+        block_start -- the sample of the output the block starts at
+        """
+
+        offset = self.position - block_start
+        while offset < len(block) and not self.finished:
+            count = min(len(self.__pending), len(block) - offset)
+            block[offset:offset + count] += self.__pending[:count]
+            self.__pending = self.__pending[count:]
+            offset += count
+            self.position += count
+            if len(self.__pending) == 0:
+                # Look ahead so that finished is known as soon as the last sample is mixed
+                self.__next_block()
+
+    def __next_block(self):
+        """Move on to the next non-empty block of the note, or finish if there are none left."""
+
+        for block in self.__blocks:
+            if len(block) > 0:
+                self.__pending = block
+                if self.__generated != None:
+                    self.__generated.append(block)
+                return
+        self.finished = True
+
+        if self.__generated:
+            note = sound.Sound(sampling_rate=self.__sampling_rate, samples=numpy.concatenate(self.__generated))
+            self.__note_cache.put(self.__key, note, len(note.samples) * note.samples.itemsize)
+            self.__generated = None
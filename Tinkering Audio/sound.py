@@ -2,16 +2,83 @@
 
 This module contains a class to be used for creating and manipulating sound.
 Sound can be created and managed using this class, and can then be saved as a
-wav file.
+wav file, either as 16-bit PCM or compressed with mu-law or IMA ADPCM.
+Samples are stored and mixed as 32-bit floats on the 16-bit scale, so that
+no precision is lost and nothing overflows while sounds are layered. They
+are only rounded to 16-bit integers once, when they are exported.
+Sounds with more than one channel store their samples interleaved, one
+frame of a sample for each channel after another, as they are in a wav file.
 
 Classes:
 Sound -- class for managing sound
+Segment -- class for referring to part of a buffer of samples without copying it
+SoundWriter -- class for writing sound to a wav file in chunks
+Resampler -- class for converting samples to another sampling rate
+AdpcmEncoder -- class for compressing samples with IMA ADPCM in chunks
+ClipMode(Enum) -- enum to store how mixed samples are kept in range
+Encoding(Enum) -- enum to store how samples are stored in a wav file
+
+Functions:
+quantise -- converts mixed samples to 16-bit integers
+get_pan_gains -- returns the gain of each channel for a panned mono sound
+encode_mu_law -- compresses 16-bit samples to 8-bit mu-law
+decode_mu_law -- expands 8-bit mu-law samples to 16-bit
+decode_adpcm -- expands IMA ADPCM blocks to 16-bit samples
 """
 
 
+# Standard Python libraries
 import array
+import fractions
 import os
-import wave
+import struct
+
+# Additional libraries
+from enum import Enum
+import numpy
+
+# Own modules
+import effects
+import profiler
+
+
+# Range of a signed 16-bit sample
+MIN_SAMPLE = -32768
+MAX_SAMPLE = 32767
+# Type code of the array that samples are stored in, 32-bit float
+SAMPLE_TYPECODE = 'f'
+# Fraction of the range that soft clipping leaves untouched
+SOFT_CLIP_KNEE = 0.75
+# Number of samples written to a file at once
+CHUNK_SIZE = 65536
+# Format tag of uncompressed samples in a wav file
+PCM_FORMAT = 1
+# Added to the magnitude of a sample before mu-law encoding, so that the
+# segments of the curve line up with powers of 2
+MU_LAW_BIAS = 132
+# Largest magnitude that can be mu-law encoded, leaving room for the bias
+MU_LAW_CLIP = 32635
+# Step sizes of IMA ADPCM, indexed by step index
+ADPCM_STEPS = [7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66,
+               73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408,
+               449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+               2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630,
+               9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+               32767]
+# Change to the step index after each IMA ADPCM code, by the code's magnitude
+ADPCM_INDEX_CHANGES = [-1, -1, -1, -1, 2, 4, 6, 8]
+# Bytes of each channel in an IMA ADPCM block at 11025Hz, doubled with each doubling of the rate
+ADPCM_BLOCK_SIZE = 256
+# Blocks are encoded this many at a time, more is quicker but holds more samples in memory
+ADPCM_BATCH_BLOCKS = 256
+# Number of changes at the start of a block that its first step size is worked out from
+ADPCM_START_CHANGES = 8
+# Number of input samples each output sample of a Resampler is calculated from
+RESAMPLE_TAPS = 32
+# Fraction of the lower Nyquist frequency that a Resampler keeps
+RESAMPLE_BANDWIDTH = 0.9
+# Shape of the Kaiser window of a Resampler's filter, higher removes more aliasing
+RESAMPLE_KAISER_BETA = 8.6
 
 
 class Sound(object):
@@ -21,36 +88,65 @@ class Sound(object):
     This class contains method for creating and manipulating sound.
     Samples can be added and manipulated before saving the sound as
     a wav file.
+    Samples are 32-bit floats that can go outside the 16-bit range while
+    sounds are being mixed. They are brought into range according to the
+    clip mode and rounded when the sound is saved.
+    The samples of a sound with several channels are interleaved. Indices,
+    positions and the length of the sound count frames, which have a sample
+    for each channel, and the chunks of such a sound are numpy arrays with a
+    row for each frame and a column for each channel, so every channel is
+    processed in the same operation. Mono sounds mixed into a sound with
+    more channels are played in every channel, or panned between them.
+    A lazy sound is stored as a list of Segments that refer to buffers of
+    samples instead of copying them. Appending, repeating, copying and
+    amplifying a lazy sound only changes its list of segments. The samples
+    are only copied into one array when they are accessed to be changed.
+    Saving a lazy sound writes the segments without copying them.
 
     Public methods:
+    load -- returns a lazy Sound backed by a memory-mapped wav file
     save -- saves the sound as a wav file
     add_sample -- adds a sample to the sound
+    add_samples -- adds a sequence of samples to the sound
     append_sound -- adds a sound to the end of the sound
     insert_sound_at_time -- adds a sound in the middle of the sound
+    delete_range -- removes the part of the sound between two times
+    replace_range -- replaces the part of the sound between two times with a sound
     layer_sound_at_time -- layers a sound over the sound
     set_sample_at_index -- sets the value of the sample at specified index
     combine_sample_at_index -- combines the value of the sample at index with another sample
+    combine_samples_at_index -- combines a sequence of samples or frames with the sound starting at index
     repeat -- makes the sound repeat the specified number of times
     reverse -- reverses the sound
+    amplify -- multiplies the volume of the sound
     copy -- makes a copy of the Sound instance
+    iter_chunks -- generates the samples of the sound a chunk at a time
     echo -- adds an echo to the sound
     feedback_echo -- adds a feedback echo to the sound
+    multi_echo -- adds several echoes to the sound, with or without feedback
+    resample -- converts the sound to another sampling rate
     convert_secs_to_samples -- converts number of seconds to number of samples
     """
 
-    def __init__(self, channels=1, sample_width=2, sampling_rate=44100, samples=None):
+    def __init__(self, channels=1, sample_width=2, sampling_rate=44100, samples=None, clip_mode=None,
+                 lazy=False):
         """Initialise the fields.
 
         Arguments:
         channels -- number of channels. Defaults to 1 (mono)
         sample_width -- sample width in bytes. Defaults to 2 (16-bit)
         sampling_rate -- samples per second. Defaults to 44100 (CD quality)
-        samples -- list of samples that the sound should begin with. Defaults to None.
+        samples -- list of interleaved samples, or numpy array of frames, that the sound should begin with.
+                   Defaults to None.
+        clip_mode -- how samples are kept in range when saved as a ClipMode. Defaults to ClipMode.hard
+        lazy -- whether the sound should be stored as segments until it is changed. Defaults to False
         """
 
+        self.clip_mode = clip_mode if clip_mode != None else ClipMode.hard
+        self.lazy = lazy
+        self.channels = channels
         self.samples = samples
         self.sample_width = sample_width
-        self.channels = channels
         self.sampling_rate = sampling_rate
 
     @property
@@ -63,14 +159,19 @@ class Sound(object):
 
     @property
     def samples(self):
+        # Samples could be changed once they are accessed, so segments are copied out first
+        if self.__segments != None:
+            self.__materialise()
         return self.__samples
 
     @samples.setter
     def samples(self, data):
-        # Array of signed short ints
-        samples = array.array('h')
-        if data != None:
-            samples.extend(data)
+        self.__segments = None
+        # Array of 32-bit floats
+        samples = array.array(SAMPLE_TYPECODE)
+        if data is not None:
+            # Convert the whole buffer at once rather than adding each sample, whatever type it is
+            samples.fromstring(numpy.asarray(data, dtype=numpy.float32).tostring())
         self.__samples = samples
 
     @property
@@ -97,30 +198,174 @@ class Sound(object):
     def sampling_rate(self, rate):
         self.__sampling_rate = rate
 
-    def save(self, directory, filename):
-        """Save the sound to a wav file of the given filename.
+    @property
+    def clip_mode(self):
+        return self.__clip_mode
+
+    @clip_mode.setter
+    def clip_mode(self, mode):
+        self.__clip_mode = mode
+
+    @property
+    def lazy(self):
+        return self.__lazy
+
+    @lazy.setter
+    def lazy(self, value):
+        self.__lazy = value
+
+    @staticmethod
+    def load(directory, filename, clip_mode=None):
+        """Return a Sound of a 16-bit PCM, mu-law or IMA ADPCM wav file.
+
+        A PCM file isn't read into memory. The returned sound is lazy and has
+        one segment referring to the memory-mapped samples, so saving it,
+        mixing it into another sound or reading it with iter_chunks only
+        reads the parts of the file that are needed. The samples are only
+        copied into memory if the sound is changed.
+        Mu-law and IMA ADPCM files are decoded into memory, and the sound has
+        one segment referring to the decoded 16-bit samples.
+
+        Arguments:
+        directory -- the directory the file is in as a string
+        filename -- the name of the file + .wav as a string
+        clip_mode -- how samples are kept in range when saved as a ClipMode. Defaults to ClipMode.hard
+        """
+
+        path = os.path.join(directory, filename)
+        wav_format, format_extension, frame_count, data_offset, data_size = Sound.__read_wav_header(path)
+        format_tag, channels, sampling_rate, byte_rate, block_align, bits_per_sample = wav_format
+        if format_tag == Encoding.mu_law.value and bits_per_sample == 8:
+            decode = decode_mu_law
+        elif format_tag == Encoding.ima_adpcm.value and bits_per_sample == 4:
+            decode = lambda data: decode_adpcm(data, channels, block_align)
+        elif format_tag != PCM_FORMAT or bits_per_sample != 16:
+            raise ValueError("%s is not a 16-bit PCM, mu-law or IMA ADPCM wav file" % filename)
+        else:
+            decode = None
+
+        sound = Sound(channels, 2, sampling_rate, None, clip_mode, lazy=True)
+        if decode != None:
+            if data_size:
+                data = numpy.memmap(path, dtype=numpy.uint8, mode='r', offset=data_offset, shape=(data_size,))
+                samples = decode(data)
+                # The last ADPCM block is padded, so only the frames in the fact chunk are kept
+                if frame_count != None:
+                    samples = samples[:frame_count * channels]
+                sound.__set_segments([Segment(samples)])
+            return sound
+
+        sample_count = data_size // 2
+        if sample_count:
+            # Wav files are always little-endian
+            samples = numpy.memmap(path, dtype='<i2', mode='r', offset=data_offset, shape=(sample_count,))
+            sound.__set_segments([Segment(samples)])
+        return sound
+
+    @staticmethod
+    def __read_wav_header(path):
+        """Return the format, format extension, frame count, data offset and data size of a wav file as a tuple.
+
+        The format is a tuple of the fields of the fmt chunk: format tag,
+        channels, sampling rate, byte rate, block align and bits per sample.
+        The format extension is the bytes after them that compressed formats
+        use, and the frame count is from the fact chunk, or None if there
+        isn't one.
+        Other chunks are skipped.
+
+        Arguments:
+        path -- the path of the wav file
+        """
+
+        with open(path, 'rb') as wav_file:
+            riff_id, riff_size, wave_id = struct.unpack('<4sI4s', wav_file.read(12))
+            if riff_id != b'RIFF' or wave_id != b'WAVE':
+                raise ValueError("%s is not a wav file" % path)
+            file_size = os.fstat(wav_file.fileno()).st_size
+
+            wav_format = None
+            format_extension = b''
+            frame_count = None
+            while True:
+                chunk_header = wav_file.read(8)
+                if len(chunk_header) < 8:
+                    raise ValueError("%s has no data chunk" % path)
+                chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+                chunk_start = wav_file.tell()
+
+                if chunk_id == b'data':
+                    if wav_format == None:
+                        raise ValueError("%s has no fmt chunk before its data" % path)
+                    # The size may be wrong if the file wasn't finished
+                    data_size = min(chunk_size, file_size - chunk_start)
+                    return wav_format, format_extension, frame_count, chunk_start, data_size
+
+                if chunk_id == b'fmt ':
+                    format_chunk = wav_file.read(chunk_size)
+                    wav_format = struct.unpack('<HHIIHH', format_chunk[:16])
+                    # Skipping the size of the extension
+                    format_extension = format_chunk[18:]
+                elif chunk_id == b'fact':
+                    frame_count = struct.unpack('<I', wav_file.read(4))[0]
+                # Chunks are padded to an even length
+                wav_file.seek(chunk_start + chunk_size + chunk_size % 2)
+
+    @profiler.measure('Sound.save', lambda self, directory, filename, *args, **kwargs: len(self))
+    def save(self, directory, filename, dither=False, sampling_rate=None, encoding=None):
+        """Save the sound to a wav file of the given filename and return the SoundWriter used.
+
+        The samples are written a chunk at a time so that a second
+        copy of the whole sound isn't made while saving. They are kept in
+        range with the sound's clip mode and rounded to 16-bit as they are
+        written. The returned writer's samples_clipped and peak show whether
+        the sound was too loud.
+        If a different sampling rate is given, the samples are resampled as
+        they are written, and the sound itself isn't changed.
 
         Arguments:
         directory -- the directory file should be saved in as a string
         filename -- the name of the file + .wav as a string
+        dither -- whether to add dither before rounding the samples. Defaults to False
+        sampling_rate -- the sampling rate of the file. Defaults to None (the sound's sampling rate)
+        encoding -- how the samples are stored in the file as an Encoding. Defaults to None (Encoding.pcm)
         """
 
-        sound = wave.open(os.path.join(directory, filename), 'wb')
-        sound.setnchannels(self.channels)
-        sound.setsampwidth(self.sample_width)
-        sound.setframerate(self.sampling_rate)
-        sound.writeframes(self.samples.tostring())
-        sound.close()
+        writer = SoundWriter(directory, filename, self.channels, self.sample_width,
+                             sampling_rate or self.sampling_rate, self.clip_mode, dither, self.sampling_rate,
+                             encoding)
+        writer.write_sound(self)
+        writer.close()
+        return writer
 
     def add_sample(self, value):
-        """Add the sample to the end of the sound."""
+        """Add the sample to the end of the sound, after the last channel of the last frame."""
 
         self.samples.append(value)
 
+    def add_samples(self, values):
+        """Add a sequence of interleaved samples to the end of the sound."""
+
+        self.samples.extend(values)
+
+    @profiler.measure('Sound.append_sound', lambda self, sound: len(sound))
     def append_sound(self, sound):
-        """Add another sound to the end of the sound."""
+        """Add another sound to the end of the sound.
 
-        self.samples.extend(sound.samples)
+        If the sound is lazy, only the other sound's segments are added, so
+        it must have the same number of channels. Otherwise a mono sound is
+        played in every channel.
+        """
+
+        if self.lazy:
+            if sound.channels != self.channels:
+                raise ValueError("A sound with %d channels can't be added to a lazy sound with %d"
+                                 % (sound.channels, self.channels))
+            self.__set_segments(self.__get_segments() + sound.__get_segments())
+        else:
+            if sound is self:
+                sound = self.copy()
+            for chunk in sound.iter_chunks():
+                self.__extend(self.__match_channels(chunk))
 
     def insert_sound_at_time(self, sound, seconds):
         """Insert a sound at the given time.
@@ -133,86 +378,248 @@ class Sound(object):
         seconds -- time it should be inserted at
         """
 
-        start_position = seconds * self.sampling_rate
-        for i in range(start_position, start_position + len(sound.samples)):
-            self.samples.insert(i, sound.samples[i-start_position])
+        self.replace_range(sound, seconds, seconds)
+
+    def delete_range(self, start_seconds, end_seconds):
+        """Remove the part of the sound between the given times.
 
-    def layer_sound_at_time(self, sound, seconds):
+        Arguments:
+        start_seconds -- time the removed part starts at
+        end_seconds -- time the removed part ends at
+        """
+
+        start_position = self.convert_secs_to_samples(start_seconds) * self.channels
+        end_position = self.convert_secs_to_samples(end_seconds) * self.channels
+        del self.samples[start_position:end_position]
+
+    @profiler.measure('Sound.replace_range', lambda self, sound, *args: len(sound))
+    def replace_range(self, sound, start_seconds, end_seconds):
+        """Replace the part of the sound between the given times with a sound.
+
+        This method splices the supplied Sound into this Sound instance in
+        place of the samples between the given times. The lengths do not
+        need to match, the rest of the sound is moved to fit.
+        The samples are moved in a single slice assignment rather than
+        one at a time.
+
+        Arguments:
+        sound -- sound to be spliced in as a Sound, with the same number of channels
+        start_seconds -- time the replaced part starts at
+        end_seconds -- time the replaced part ends at
+        """
+
+        if sound.channels != self.channels:
+            raise ValueError("A sound with %d channels can't be spliced into a sound with %d"
+                             % (sound.channels, self.channels))
+        start_position = self.convert_secs_to_samples(start_seconds) * self.channels
+        end_position = self.convert_secs_to_samples(end_seconds) * self.channels
+        self.samples[start_position:end_position] = sound.samples
+
+    @profiler.measure('Sound.layer_sound_at_time', lambda self, sound, seconds, *args: len(sound))
+    def layer_sound_at_time(self, sound, seconds, pan=None):
         """Overlay a sound at the given time.
 
         This method layers the supplied Sound over this Sound instance
         at the time specified in seconds.
+        A mono sound is played in every channel, unless a pan is given.
 
         Arguments:
         sound -- sound to be overlayed as a Sound
         seconds -- time it should be added at
+        pan -- where to place a mono sound between the channels, from -1 to 1. Defaults to None (every channel)
         """
 
-        start_position = int(seconds * self.sampling_rate)
-        for i in range(start_position, start_position + len(sound.samples)):
-            self.combine_sample_at_index(sound.samples[i - start_position], i)
+        if sound is self:
+            sound = self.copy()
+
+        start_position = self.convert_secs_to_samples(seconds)
+        self.__grow(start_position + len(sound))
+        for chunk in sound.iter_chunks():
+            self.combine_samples_at_index(chunk, start_position, pan)
+            start_position += len(chunk)
 
     def set_sample_at_index(self, value, index):
-        """Set the value of the sample at the specified index"""
+        """Set the value of every channel of the frame at the specified index"""
 
-        self.samples[index] = value
+        self.__as_frames(self.samples)[index] = value
 
     def combine_sample_at_index(self, value, index):
         """Add the value to the sample at the specified index"""
 
-        if len(self.samples) > index:
-            self.samples[index] += value
-        else:
-            self.add_sample(value)
+        self.combine_samples_at_index([value], index)
+
+    @profiler.measure('Sound.combine_samples_at_index', lambda self, values, index, *args: len(values))
+    def combine_samples_at_index(self, values, index, pan=None):
+        """Add a sequence of samples or frames to the sound starting at the specified index.
+
+        This method mixes a whole buffer of samples into the sound in one
+        operation. If the samples extend past the end of the sound, the sound
+        is extended once to fit them. The mixed samples aren't clipped, as
+        they are only brought into range when the sound is saved.
+        The values can be mono samples, which are mixed into every channel or
+        panned with the gains from get_pan_gains, or a numpy array of frames
+        with a column for each of the sound's channels.
+
+        Arguments:
+        values -- the samples to be mixed in as an array, list or numpy array
+        index -- the index of the frame that the first sample should be mixed in at
+        pan -- where to place mono samples between the channels, from -1 to 1. Defaults to None (every channel)
+        """
+
+        values = self.__match_channels(self.__as_numpy(values), pan)
+        end_index = index + len(values)
+        # Growing the sound can move its samples, so values from the sound itself,
+        # such as its own chunks, are copied before they can be left pointing at freed memory
+        if end_index > len(self) and numpy.may_share_memory(values, self.__as_numpy(self.samples)):
+            values = values.copy()
+        # Grow the sound once rather than once per sample
+        self.__grow(end_index)
+
+        target = self.__as_frames(self.samples)[index:end_index]
+        target += values
 
     def repeat(self, repeats):
         """Make the sound be repeated.
 
         This method appends a copy of the sound to the
         end the specified number of times.
+        The frames are interleaved, so the whole buffer is repeated at once
+        whatever the number of channels.
+
+        If the sound is lazy, only references to its segments are repeated.
 
         repeats -- number of additional times sound should repeat
         """
 
-        original_sound = self.copy()
-        for i in range(repeats):
-            self.append_sound(original_sound)
+        if self.lazy:
+            self.__set_segments(self.__get_segments() * (repeats + 1))
+            return
+
+        self.samples = numpy.tile(self.__as_numpy(self.samples), repeats + 1)
 
     def reverse(self):
-        """Reverse the sound."""
+        """Reverse the order of the frames of the sound, keeping the channels in order."""
+
+        frames = self.__as_frames(self.samples)
+        frames[:] = frames[::-1].copy()
+
+    def amplify(self, gain):
+        """Multiply the volume of the sound by the gain.
+
+        If the sound is lazy, only the gains of its segments are changed.
+
+        Arguments:
+        gain -- the number the samples are multiplied by as a float
+        """
 
-        self.samples.reverse()
+        if self.lazy:
+            self.__set_segments([segment.amplify(gain) for segment in self.__get_segments()])
+        else:
+            self.samples = self.__as_numpy(self.samples) * gain
 
     def copy(self):
-        """Return a copy of the sound object as a new instance."""
+        """Return a copy of the sound object as a new instance.
+
+        The copy of a lazy sound shares its segments.
+        """
 
-        sound = Sound(self.channels, self.sample_width,
-                      self.sampling_rate, self.samples)
+        sound = Sound(self.channels, self.sample_width, self.sampling_rate,
+                      None, self.clip_mode, self.lazy)
+        if self.lazy:
+            sound.__set_segments(list(self.__get_segments()))
+        else:
+            sound.samples = self.samples
         return sound
 
-    def echo(self, delay, vol_reduction):
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        """Generate the samples of the sound as numpy arrays of up to chunk_size frames.
+
+        The segments of a lazy sound are read without copying them into one
+        array. The chunks may share memory with the sound, so they should not
+        be changed.
+        Chunks of a mono sound are 1D, and chunks of a sound with more
+        channels have a row for each frame and a column for each channel.
+
+        Arguments:
+        chunk_size -- the maximum number of frames in each chunk. Defaults to CHUNK_SIZE
+        """
+
+        # Segments and the array of samples are interleaved
+        step = chunk_size * self.channels
+        if self.__segments != None:
+            for segment in self.__segments:
+                for start in xrange(0, segment.length, step):
+                    yield self.__as_frames(segment.read(start, min(step, segment.length - start)))
+        else:
+            frames = self.__as_frames(self.__samples)
+            for start in xrange(0, len(frames), chunk_size):
+                yield frames[start:start + chunk_size]
+
+    def echo(self, delay, vol_reduction, in_samples=False):
         """Add an echo effect to the sound.
 
         Arguments:
         delay -- amount of time that the echo will be delayed by in seconds
         vol_reduction -- fraction of the original volume that the echo will be (float between 0 and 1)
+        in_samples -- whether delay is given in samples rather than seconds. Defaults to False
         """
 
-        echo = Sound()
-        echo.samples = self.samples
-        for i in range(len(echo.samples)):
-            self.combine_sample_at_index(int(vol_reduction * echo.samples[i]), i + delay)
+        self.multi_echo([(delay, vol_reduction)], False, in_samples)
 
-    def feedback_echo(self, delay, vol_reduction):
+    def feedback_echo(self, delay, vol_reduction, in_samples=False):
         """Add an echo effect with feedback to the sound.
 
         Arguments:
         delay -- amount of time that the echo will be delayed by in seconds
         vol_reduction -- percentage of the original volume that the echo will be (float between 0 and 1)
+        in_samples -- whether delay is given in samples rather than seconds. Defaults to False
         """
 
-        for i in range(len(self.samples)):
-            self.combine_sample_at_index(int(vol_reduction * self.samples[i]), i + delay)
+        self.multi_echo([(delay, vol_reduction)], True, in_samples)
+
+    @profiler.measure('Sound.multi_echo', lambda self, *args, **kwargs: len(self))
+    def multi_echo(self, taps, feedback=False, in_samples=False):
+        """Add several echoes to the sound with a comb filter.
+
+        This method runs the sound through an effects.CombFilter a chunk at
+        a time, with every channel filtered together. The sound is extended
+        by the longest delay so that the echoes of the end of the sound can
+        be heard.
+
+        Arguments:
+        taps -- list of (delay, vol_reduction) tuples, one for each echo
+        feedback -- whether the echoes should be echoed again. Defaults to False
+        in_samples -- whether the delays are given in samples rather than seconds. Defaults to False
+        """
+
+        if not in_samples:
+            taps = [(self.convert_secs_to_samples(delay), vol_reduction) for delay, vol_reduction in taps]
+        comb_filter = effects.CombFilter(taps, feedback)
+
+        filtered = [comb_filter.process(chunk) for chunk in self.iter_chunks()]
+        filtered.append(comb_filter.flush())
+        self.samples = numpy.concatenate(filtered)
+
+    @profiler.measure('Sound.resample', lambda self, sampling_rate: len(self))
+    def resample(self, sampling_rate):
+        """Convert the sound to the given sampling rate.
+
+        This method runs the sound through a Resampler a chunk at a time, so
+        it keeps the same length in seconds and pitch. It can be used to
+        decimate a sound that was rendered at a higher rate to reduce aliasing.
+
+        Arguments:
+        sampling_rate -- the new sampling rate
+        """
+
+        if sampling_rate == self.sampling_rate:
+            return
+        resampler = Resampler(self.sampling_rate, sampling_rate)
+
+        resampled = [resampler.process(chunk) for chunk in self.iter_chunks()]
+        resampled.append(resampler.flush())
+        self.samples = numpy.concatenate(resampled)
+        self.sampling_rate = sampling_rate
 
     def convert_secs_to_samples(self, seconds):
         """Convert seconds into sample number and return as an integer.
@@ -222,14 +629,822 @@ class Sound(object):
 
         return int(self.sampling_rate * seconds)
 
+    def __get_segments(self):
+        """Return a list of Segments making up the sound without changing its samples.
+
+        If the sound isn't stored as segments, its samples are copied into a
+        new segment, so that changing the sound won't change the segment.
+        A lazy sound is then stored as that segment, so that later lazy
+        operations reuse it rather than copying the samples again.
+        """
+
+        if self.__segments != None:
+            return self.__segments
+
+        buffer = self.__as_numpy(self.__samples).copy()
+        segments = [Segment(buffer)] if len(buffer) else []
+        if self.lazy:
+            self.__set_segments(segments)
+        return segments
+
+    def __set_segments(self, segments):
+        """Store the sound as a list of Segments."""
+
+        self.__segments = segments
+        self.__samples = None
+
+    def __materialise(self):
+        """Copy the segments of the sound into one array of samples."""
+
+        segments = self.__segments
+        if segments:
+            self.samples = numpy.concatenate([segment.read(0, segment.length) for segment in segments])
+        else:
+            self.samples = None
+
+    def __extend(self, values):
+        """Add a numpy array of samples or frames to the end of the sound."""
+
+        self.samples.fromstring(numpy.asarray(values, dtype=numpy.float32).tostring())
+
+    def __grow(self, length):
+        """Add silence to the end of the sound so it is at least length frames long."""
+
+        if length > len(self):
+            self.samples.extend(array.array(SAMPLE_TYPECODE, [0]) * ((length - len(self)) * self.channels))
+
+    def __as_frames(self, samples):
+        """Return interleaved samples as a numpy array with a row for each frame, or 1D if the sound is mono."""
+
+        samples = self.__as_numpy(samples)
+        if self.channels > 1:
+            return samples.reshape(-1, self.channels)
+        return samples
+
+    def __match_channels(self, values, pan=None):
+        """Return a numpy array of samples or frames with the same channels as the sound.
+
+        Mono samples are played in every channel, or panned between them
+        if a pan is given. Pan has no effect on a mono sound.
+        """
+
+        if values.ndim == 1:
+            if self.channels == 1:
+                return values
+            if pan == None:
+                return numpy.broadcast_to(values[:, numpy.newaxis], (len(values), self.channels))
+            # An outer product, which numpy does much faster than broadcasting over a few columns
+            return numpy.einsum('i,j->ij', values, get_pan_gains(pan, self.channels).astype(numpy.float32))
+
+        if pan != None:
+            raise ValueError("Only mono samples can be panned")
+        if values.shape[1] != self.channels:
+            raise ValueError("Frames with %d channels can't be mixed into a sound with %d"
+                             % (values.shape[1], self.channels))
+        return values if self.channels > 1 else values[:, 0]
+
+    def __as_numpy(self, samples):
+        """Return samples as a numpy array, without copying if they are an array of samples."""
+
+        if isinstance(samples, array.array):
+            return numpy.frombuffer(samples, dtype=samples.typecode)
+        else:
+            return numpy.asarray(samples)
+
+    def __len__(self):
+        # The number of frames, as the samples are interleaved
+        if self.__segments != None:
+            return sum(segment.length for segment in self.__segments) // self.channels
+        else:
+            return len(self.__samples) // self.channels
+
+    @profiler.measure('Sound.__add__', lambda self, other: max(len(self), len(other)))
     def __add__(self, other):
-        sound = Sound()
-        if len(self.samples) >= len(other.samples):
-            sound.samples = self.samples
-            for i in range(len(other.samples)):
-                sound.samples[i] += other.samples[i]
+        if self.channels != other.channels:
+            # The sum has the channels of whichever sound has more, with a mono sound panned to the centre
+            wider, narrower = (self, other) if self.channels > other.channels else (other, self)
+            sound = wider.copy()
+            sound.layer_sound_at_time(narrower, 0, 0.0 if narrower.channels == 1 else None)
+            return sound
+
+        if len(self) >= len(other):
+            sound = self.copy()
+            sound.layer_sound_at_time(other, 0)
         else:
-            sound.samples = other.samples
-            for i in range(len(self.samples)):
-                sound.samples[i] += self.samples[i]
+            sound = other.copy()
+            sound.layer_sound_at_time(self, 0)
         return sound
+
+
+class Segment(object):
+
+    """Refer to part of a buffer of samples without copying it.
+
+    This class stores a reference to a numpy array of samples, along with
+    the offset and length of the part of it that is used and a gain that
+    the samples are multiplied by when they are read.
+    The buffer must not be changed once it is in a segment, as it may be
+    shared by many segments and sounds. Segments are never changed either,
+    methods that would change them return a new Segment instead.
+
+    Public Methods:
+    read -- returns samples from the segment with the gain applied
+    amplify -- returns a new segment with the gain multiplied
+
+    Public Fields and Properties:
+    buffer -- the numpy array of samples the segment refers to
+    offset -- the index of the first sample of the segment in the buffer
+    length -- the number of samples in the segment
+    gain -- the number the samples are multiplied by when read
+    """
+
+    def __init__(self, buffer, offset=0, length=None, gain=1.0):
+        """Initialise the fields.
+
+        Arguments:
+        buffer -- the numpy array of samples the segment refers to
+        offset -- the index of the first sample of the segment in the buffer. Defaults to 0
+        length -- the number of samples in the segment. Defaults to None (the rest of the buffer)
+        gain -- the number the samples are multiplied by when read. Defaults to 1.0
+        """
+
+        buffer.flags.writeable = False
+        self.__buffer = buffer
+        self.__offset = offset
+        self.__length = length if length != None else len(buffer) - offset
+        self.__gain = gain
+
+    @property
+    def buffer(self):
+        return self.__buffer
+
+    @property
+    def offset(self):
+        return self.__offset
+
+    @property
+    def length(self):
+        return self.__length
+
+    @property
+    def gain(self):
+        return self.__gain
+
+    def read(self, start, count):
+        """Return count samples from start in the segment as a numpy array.
+
+        If the gain is 1 the samples are a read-only view of the buffer,
+        otherwise they are a new array of floats.
+
+        Arguments:
+        start -- the index in the segment of the first sample to read
+        count -- the number of samples to read
+        """
+
+        first = self.offset + start
+        samples = self.buffer[first:first + count]
+        if self.gain != 1.0:
+            samples = samples * self.gain
+        return samples
+
+    def amplify(self, gain):
+        """Return a new Segment of the same samples with the gain multiplied by gain."""
+
+        return Segment(self.buffer, self.offset, self.length, self.gain * gain)
+
+
+class SoundWriter(object):
+
+    """Contain methods for writing sound to a wav file as it is rendered.
+
+    This class keeps a wav file open so that samples can be written to it
+    in chunks as they are produced, rather than collecting the whole sound
+    in memory first. The header is finished when the writer is closed.
+    It can be used in a with statement to make sure it is closed.
+    The samples are written to a temporary file in the same directory,
+    which replaces the file when the writer is closed. This means a sound
+    loaded from a file, which reads the file as it is saved, can be saved
+    back to the same file.
+    This is where mixed samples are converted to 16-bit, with quantise.
+    They are then stored as they are, or compressed to 8-bit mu-law or
+    4-bit IMA ADPCM, depending on the writer's encoding. Mu-law and ADPCM
+    files have a fact chunk with the number of frames, as ADPCM is written
+    in whole blocks and the last one is padded.
+    The writer counts the samples that had to be clipped and the loudest
+    sample, so that sounds that are too loud can be found.
+    If the samples are at a different sampling rate to the file, they are
+    converted with a Resampler as they are written, so sounds rendered at a
+    higher rate can be decimated without holding them in memory.
+
+    Public Methods:
+    write_samples -- writes a sequence of samples to the end of the file
+    write_sound -- writes a Sound to the end of the file
+    close -- finishes the file and closes it
+
+    Public Fields and Properties:
+    source_rate -- the sampling rate of the samples written to the writer
+    encoding -- how the samples are stored in the file as an Encoding
+    samples_written -- the number of frames (samples per channel) written to the file so far
+    samples_clipped -- the number of samples written that were outside the 16-bit range
+    peak -- the largest magnitude of the samples written, before they were clipped
+    """
+
+    def __init__(self, directory, filename, channels=1, sample_width=2, sampling_rate=44100, clip_mode=None,
+                 dither=False, source_rate=None, encoding=None):
+        """Open the file and write its format.
+
+        Arguments:
+        directory -- the directory file should be saved in as a string
+        filename -- the name of the file + .wav as a string
+        channels -- number of channels. Defaults to 1 (mono)
+        sample_width -- sample width in bytes. Defaults to 2 (16-bit)
+        sampling_rate -- samples per second. Defaults to 44100 (CD quality)
+        clip_mode -- how samples are kept in range as a ClipMode. Defaults to ClipMode.hard
+        dither -- whether to add dither before rounding the samples. Defaults to False
+        source_rate -- the sampling rate of the samples written. Defaults to None (the file's sampling rate)
+        encoding -- how the samples are stored in the file as an Encoding. Defaults to None (Encoding.pcm)
+        """
+
+        self.channels = channels
+        self.sample_width = sample_width
+        self.sampling_rate = sampling_rate
+        self.source_rate = source_rate or sampling_rate
+        self.clip_mode = clip_mode
+        self.encoding = encoding if encoding != None else Encoding.pcm
+        self.samples_written = 0
+        self.samples_clipped = 0
+        self.peak = 0.0
+        self.__random = numpy.random.RandomState() if dither else None
+        if self.source_rate != sampling_rate:
+            self.__resampler = Resampler(self.source_rate, sampling_rate)
+        else:
+            self.__resampler = None
+
+        self.__encoder = None
+        if self.encoding == Encoding.mu_law:
+            self.__format = (self.encoding.value, channels, sampling_rate, sampling_rate * channels, channels, 8)
+            self.__format_extension = b''
+        elif self.encoding == Encoding.ima_adpcm:
+            block_align = ADPCM_BLOCK_SIZE * channels * max(1, sampling_rate // 11025)
+            self.__encoder = AdpcmEncoder(channels, block_align)
+            byte_rate = sampling_rate * block_align // self.__encoder.samples_per_block
+            self.__format = (self.encoding.value, channels, sampling_rate, byte_rate, block_align, 4)
+            self.__format_extension = struct.pack('<H', self.__encoder.samples_per_block)
+        else:
+            self.__format = (PCM_FORMAT, channels, sampling_rate, sampling_rate * channels * sample_width,
+                             channels * sample_width, sample_width * 8)
+            self.__format_extension = b''
+        self.__data_size = 0
+
+        self.__path = os.path.join(directory, filename)
+        self.__temporary_path = self.__path + '.tmp'
+        self.__file = open(self.__temporary_path, 'wb')
+        # Written again with the sizes once the writer is closed
+        self.__write_header()
+
+    @profiler.measure('SoundWriter.write_samples', lambda self, values: len(values))
+    def write_samples(self, values):
+        """Write a sequence of samples to the end of the file.
+
+        The samples are resampled if they are at a different rate to the
+        file, then converted to 16-bit with quantise, using the writer's clip
+        mode and dither.
+
+        Arguments:
+        values -- the interleaved samples as an array, list or numpy array, or a numpy array of
+                  frames, at the source rate
+        """
+
+        if isinstance(values, array.array):
+            values = numpy.frombuffer(values, dtype=values.typecode)
+        else:
+            values = numpy.asarray(values)
+        if self.channels > 1 and values.ndim == 1:
+            values = values.reshape(-1, self.channels)
+
+        if self.__resampler != None:
+            values = self.__resampler.process(values)
+        self.__write(values)
+
+    def write_sound(self, sound, repeats=1):
+        """Write a Sound to the end of the file a chunk at a time.
+
+        Arguments:
+        sound -- the Sound to be written, at the source rate
+        repeats -- number of times the sound should be written. Defaults to 1
+        """
+
+        for i in xrange(repeats):
+            for chunk in sound.iter_chunks():
+                self.write_samples(chunk)
+
+    def close(self):
+        """Write the end of any resampled or encoded samples, then finish the header of the file and close it.
+
+        The finished file then replaces the file at the writer's path.
+        """
+
+        if self.__file.closed:
+            return
+
+        if self.__resampler != None:
+            self.__write(self.__resampler.flush())
+            self.__resampler = None
+        if self.__encoder != None:
+            self.__write_data(self.__encoder.flush())
+        # The data chunk is padded to an even length
+        if self.__data_size % 2:
+            self.__file.write(b'\0')
+        self.__file.seek(0)
+        self.__write_header()
+        self.__file.close()
+
+        try:
+            os.rename(self.__temporary_path, self.__path)
+        except OSError:
+            # Windows can't rename over a file that exists
+            os.remove(self.__path)
+            os.rename(self.__temporary_path, self.__path)
+
+    def __write(self, values):
+        """Convert a numpy array of samples or frames at the file's rate to 16-bit, encode and write them."""
+
+        if len(values):
+            magnitude = numpy.abs(values.astype(float))
+            self.peak = max(self.peak, float(magnitude.max()))
+            self.samples_clipped += int(numpy.count_nonzero((values < MIN_SAMPLE) | (values > MAX_SAMPLE)))
+        samples = quantise(values, self.clip_mode, self.__random)
+        if self.encoding == Encoding.mu_law:
+            self.__write_data(encode_mu_law(samples).tostring())
+        elif self.encoding == Encoding.ima_adpcm:
+            self.__write_data(self.__encoder.encode(samples))
+        else:
+            # Wav files are always little-endian
+            self.__write_data(samples.astype('<i2').tostring())
+        self.samples_written += len(values)
+
+    def __write_data(self, data):
+        """Write bytes to the end of the data chunk."""
+
+        self.__file.write(data)
+        self.__data_size += len(data)
+
+    def __write_header(self):
+        """Write the chunks before the samples, with the sizes of the data written so far.
+
+        The header is always the same length, so it can be written over
+        the placeholder written when the file was opened.
+        """
+
+        format_chunk = struct.pack('<HHIIHH', *self.__format)
+        if self.encoding != Encoding.pcm:
+            # The size of the extension comes before it
+            format_chunk += struct.pack('<H', len(self.__format_extension)) + self.__format_extension
+        chunks = struct.pack('<4sI', b'fmt ', len(format_chunk)) + format_chunk
+        if self.encoding != Encoding.pcm:
+            chunks += struct.pack('<4sII', b'fact', 4, self.samples_written)
+        riff_size = 4 + len(chunks) + 8 + self.__data_size + self.__data_size % 2
+        self.__file.write(struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE'))
+        self.__file.write(chunks)
+        self.__file.write(struct.pack('<4sI', b'data', self.__data_size))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class Resampler(object):
+
+    """Contain methods and fields for converting samples to another sampling rate.
+
+    This class is a polyphase resampler. The ratio of the rates is reduced
+    to up / down, and the samples are treated as if up - 1 zeros were put
+    between each of them, low-pass filtered and then only every down-th
+    sample kept. The zeros and the samples that aren't kept are never
+    calculated, instead each output sample is worked out from RESAMPLE_TAPS
+    input samples using the phase of the filter that lines up with them,
+    and a whole block of output samples is calculated at once.
+    The filter is a Kaiser-windowed sinc that removes everything above the
+    lower of the two Nyquist frequencies, so decimating doesn't alias.
+    Samples from the end of each block are kept so that blocks can be
+    processed one after another as if they were one signal, like
+    effects.CombFilter. Blocks with a column for each channel have every
+    channel resampled at once.
+
+    Public Methods:
+    process -- returns the resampled samples that a block completes
+    flush -- returns the rest of the resampled samples after the last block
+    reset -- forgets the previous blocks
+
+    Public Fields and Properties:
+    from_rate -- the sampling rate of the input
+    to_rate -- the sampling rate of the output
+    up -- the number of output samples for every down input samples
+    down -- the number of input samples for every up output samples
+    """
+
+    def __init__(self, from_rate, to_rate):
+        """Initialise the fields and design the filter.
+
+        Arguments:
+        from_rate -- the sampling rate of the input
+        to_rate -- the sampling rate of the output
+        """
+
+        self.from_rate = from_rate
+        self.to_rate = to_rate
+        ratio = fractions.Fraction(int(to_rate), int(from_rate))
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+
+        self.__phases = self.__design_filter()
+        # Index of the upsampled signal at the centre of the filter
+        self.__delay = RESAMPLE_TAPS * self.up // 2 - 1
+        self.__tap_offsets = numpy.arange(RESAMPLE_TAPS)
+        self.reset()
+
+    def reset(self):
+        """Forget the previous blocks so the next block is treated as the start."""
+
+        # Input before the start is silent, so the buffer starts with a filter's worth of zeros
+        # once the number of channels is known from the first block
+        self.__buffer = None
+        # Index in the input of the first sample in the buffer
+        self.__buffer_start = 1 - RESAMPLE_TAPS
+        self.__samples_in = 0
+        self.__samples_out = 0
+
+    def process(self, block):
+        """Return the resampled samples that can be calculated once the block has been added.
+
+        The output lags the input by half the filter's length, so the last
+        samples are only returned by flush.
+
+        Arguments:
+        block -- the samples to resample as a numpy array, or a numpy array of frames
+        """
+
+        block = numpy.asarray(block, dtype=float)
+        if self.__buffer is None:
+            self.__buffer = numpy.zeros((RESAMPLE_TAPS - 1,) + block.shape[1:])
+        self.__buffer = numpy.concatenate((self.__buffer, block))
+        self.__samples_in += len(block)
+        # The last output sample whose newest input sample has arrived
+        last = (self.__samples_in * self.up - 1 - self.__delay) // self.down
+        return self.__calculate(last + 1)
+
+    def flush(self):
+        """Return the rest of the resampled samples, so the output lasts as long as the input."""
+
+        total = -(-self.__samples_in * self.up // self.down)
+        if self.__buffer is None:
+            self.__buffer = numpy.zeros(RESAMPLE_TAPS - 1)
+        # The filter reaches past the end of the input, where it is silent
+        self.__buffer = numpy.concatenate((self.__buffer, numpy.zeros((RESAMPLE_TAPS,) + self.__buffer.shape[1:])))
+        return self.__calculate(total)
+
+    def __calculate(self, end):
+        """Return the output samples up to end and drop the input that won't be needed again."""
+
+        outputs = numpy.arange(self.__samples_out, max(end, self.__samples_out))
+        # Position of each output sample in the upsampled signal, and the phase of the filter there
+        positions = outputs * self.down + self.__delay
+        newest = positions // self.up
+        phases = positions % self.up
+
+        indices = newest[:, numpy.newaxis] - self.__tap_offsets - self.__buffer_start
+        # Each channel of a frame is multiplied by the same taps
+        samples = numpy.einsum('ij,ij...->i...', self.__phases[phases], self.__buffer[indices])
+        self.__samples_out += len(outputs)
+
+        next_newest = (self.__samples_out * self.down + self.__delay) // self.up
+        first_needed = next_newest - (RESAMPLE_TAPS - 1) - self.__buffer_start
+        if first_needed > 0:
+            self.__buffer = self.__buffer[first_needed:]
+            self.__buffer_start += first_needed
+        return samples
+
+    def __design_filter(self):
+        """Return the low-pass filter split into its phases, with a row of RESAMPLE_TAPS values per phase.
+
+        Row p holds the values of the filter at p, p + up, p + 2 * up and so
+        on, which are the values lined up with input samples when the output
+        sample falls at phase p.
+        """
+
+        length = RESAMPLE_TAPS * self.up - 1
+        # Cut-off as a fraction of the upsampled rate
+        cutoff = RESAMPLE_BANDWIDTH * 0.5 / max(self.up, self.down)
+        times = numpy.arange(length) - (length - 1) / 2.0
+        # Multiplied by up to make up for the zeros between the input samples
+        values = self.up * 2.0 * cutoff * numpy.sinc(2.0 * cutoff * times)
+        values *= numpy.kaiser(length, RESAMPLE_KAISER_BETA)
+        # Padded to a whole number of taps for each phase
+        values = numpy.append(values, 0.0)
+        return values.reshape(RESAMPLE_TAPS, self.up).T.copy()
+
+
+class AdpcmEncoder(object):
+
+    """Contain methods and fields for compressing samples with IMA ADPCM in chunks.
+
+    This class stores each 16-bit sample as a 4-bit code for the change from
+    the last sample, scaled by a step size that grows and shrinks with the
+    changes. Samples are encoded in blocks, each starting with a header of
+    its first sample and step index, as in the wav files made by Microsoft's
+    encoder.
+    The codes of a sample depend on the samples before it in the block, so
+    a block can't be encoded all at once. Instead, every block's step size
+    is worked out from its own first changes, so blocks don't depend on each
+    other, and the nth sample of ADPCM_BATCH_BLOCKS blocks is encoded at once.
+    Samples are kept until there are enough for a batch, so that encoding a
+    sound a chunk at a time is as quick as encoding it all at once.
+
+    Public Methods:
+    encode -- adds samples and returns the bytes of any blocks that are ready
+    flush -- returns the bytes of the remaining samples, padded to a whole block
+
+    Public Fields and Properties:
+    channels -- number of channels
+    block_align -- the number of bytes in a block
+    samples_per_block -- the number of frames in a block
+    """
+
+    def __init__(self, channels=1, block_align=1024):
+        """Initialise the fields.
+
+        Arguments:
+        channels -- number of channels. Defaults to 1 (mono)
+        block_align -- the number of bytes in a block, a multiple of 4 bytes for each channel. Defaults to 1024
+        """
+
+        if block_align % (4 * channels) or block_align <= 4 * channels:
+            raise ValueError("ADPCM blocks must be a multiple of 4 bytes for each channel, and more than 1")
+
+        self.channels = channels
+        self.block_align = block_align
+        # The first sample of each channel is in the header, the rest are 2 to a byte
+        self.samples_per_block = (block_align - 4 * channels) * 2 // channels + 1
+        self.__pending = []
+        self.__pending_count = 0
+
+    def encode(self, samples):
+        """Add samples and return the bytes of any whole blocks that are ready to be written.
+
+        Arguments:
+        samples -- numpy array of interleaved 16-bit samples, or of frames
+        """
+
+        frames = numpy.reshape(samples, (-1, self.channels))
+        self.__pending.append(frames)
+        self.__pending_count += len(frames)
+        if self.__pending_count < ADPCM_BATCH_BLOCKS * self.samples_per_block:
+            return b''
+
+        frames = numpy.concatenate(self.__pending)
+        whole = len(frames) // self.samples_per_block * self.samples_per_block
+        self.__pending = [frames[whole:]]
+        self.__pending_count = len(frames) - whole
+        return self.__encode_blocks(frames[:whole])
+
+    def flush(self):
+        """Return the bytes of the samples that haven't been encoded yet.
+
+        The last block is padded by repeating its last frame, so the number
+        of frames should be stored as well, as it is in a wav file's fact chunk.
+        """
+
+        if self.__pending_count == 0:
+            return b''
+
+        frames = numpy.concatenate(self.__pending)
+        padding = -len(frames) % self.samples_per_block
+        frames = numpy.concatenate([frames, numpy.repeat(frames[-1:], padding, axis=0)])
+        self.__pending = []
+        self.__pending_count = 0
+        return self.__encode_blocks(frames)
+
+    def __encode_blocks(self, frames):
+        """Return the bytes of numpy array of frames that is a whole number of blocks long."""
+
+        block_count = len(frames) // self.samples_per_block
+        rows = block_count * self.channels
+        # A column for each channel of each block, so that each sample of every block is one row
+        samples = frames.reshape(block_count, self.samples_per_block, self.channels).transpose(1, 0, 2)
+        samples = samples.reshape(self.samples_per_block, rows).astype(numpy.int32)
+
+        steps = numpy.array(ADPCM_STEPS)
+        first_changes = numpy.abs(numpy.diff(samples[:ADPCM_START_CHANGES + 1], axis=0)).mean(axis=0)
+        first_index = numpy.minimum(numpy.searchsorted(steps, first_changes), len(steps) - 1)
+        changes, next_indices = _get_adpcm_tables()
+
+        predictor = samples[0]
+        index = first_index
+        codes = numpy.empty((self.samples_per_block - 1, rows), dtype=numpy.uint8)
+        for i in xrange(1, self.samples_per_block):
+            difference = samples[i] - predictor
+            # Each step of the code's magnitude is a quarter of the step size
+            magnitude = numpy.minimum((numpy.abs(difference) * 4) // steps[index], 7)
+            table_index = index * 16 + magnitude + (difference < 0) * 8
+            # Following the decoder, so that its errors aren't added up
+            predictor = numpy.clip(predictor + changes[table_index], MIN_SAMPLE, MAX_SAMPLE)
+            index = next_indices[table_index]
+            codes[i - 1] = table_index & 15
+
+        # Each block's header has the first sample and step index of each channel
+        header = numpy.zeros((block_count, self.channels, 4), dtype=numpy.uint8)
+        first_samples = samples[0].astype('<i2').view(numpy.uint8)
+        header[:, :, :2] = first_samples.reshape(block_count, self.channels, 2)
+        header[:, :, 2] = first_index.reshape(block_count, self.channels)
+
+        # Two codes to a byte, the first in the low bits, with 4 bytes of each channel in turn
+        codes = codes.T.reshape(block_count, self.channels, -1)
+        packed = codes[:, :, 0::2] | (codes[:, :, 1::2] << 4)
+        packed = packed.reshape(block_count, self.channels, -1, 4).transpose(0, 2, 1, 3)
+        blocks = numpy.concatenate([header.reshape(block_count, -1), packed.reshape(block_count, -1)], axis=1)
+        return blocks.tostring()
+
+
+def quantise(samples, clip_mode=None, random_state=None):
+    """Return mixed samples rounded to a numpy array of 16-bit integers.
+
+    Samples are brought within the 16-bit range using the clip mode. Hard
+    clipping saturates samples at the limits of the range. Soft clipping
+    leaves samples below the knee untouched and smoothly compresses the
+    rest so that they approach the limits without reaching them.
+    If a random state is given, triangular dither of up to 1 either way is
+    added before rounding, so that quiet parts fade into noise rather than
+    into distortion.
+    Integer samples that are already in range are returned unchanged.
+
+    Arguments:
+    samples -- numpy array of mixed samples
+    clip_mode -- how samples are kept in range as a ClipMode. Defaults to None (hard)
+    random_state -- numpy.random.RandomState used for dither. Defaults to None (no dither)
+    """
+
+    if samples.dtype == numpy.int16 and random_state is None:
+        return samples
+
+    samples = samples.astype(float)
+    if clip_mode == ClipMode.soft:
+        knee = SOFT_CLIP_KNEE * MAX_SAMPLE
+        headroom = MAX_SAMPLE - knee
+        magnitude = numpy.abs(samples)
+        loud = magnitude > knee
+        if loud.any():
+            compressed = knee + headroom * numpy.tanh((magnitude[loud] - knee) / headroom)
+            samples[loud] = numpy.sign(samples[loud]) * compressed
+    if random_state is not None:
+        samples += random_state.triangular(-1.0, 0.0, 1.0, samples.shape)
+    return numpy.clip(numpy.rint(samples), MIN_SAMPLE, MAX_SAMPLE).astype(numpy.int16)
+
+
+def get_pan_gains(pan, channels):
+    """Return a numpy array of the gain of each channel for a mono sound at the given pan.
+
+    The pan goes from -1 at the first channel to 1 at the last, with the
+    channels spread evenly between, so for stereo -1 is left, 0 is the
+    centre and 1 is right. A sound between two channels is shared between
+    them with constant power panning, so it is as loud wherever it is.
+
+    Arguments:
+    pan -- where to place the sound between the channels, from -1 to 1
+    channels -- the number of channels
+    """
+
+    if channels == 1:
+        return numpy.ones(1)
+
+    position = (min(max(pan, -1.0), 1.0) + 1.0) / 2.0 * (channels - 1)
+    # The channel before the sound, which is the second to last at the very end
+    lower = min(int(position), channels - 2)
+    angle = (position - lower) * numpy.pi / 2.0
+    gains = numpy.zeros(channels)
+    gains[lower] = numpy.cos(angle)
+    gains[lower + 1] = numpy.sin(angle)
+    return gains
+
+
+def encode_mu_law(samples):
+    """Return 16-bit samples compressed to a numpy array of 8-bit mu-law codes.
+
+    Each code has a sign, a 3-bit segment and a 4-bit position in the
+    segment, with each segment twice as wide as the one before, so quiet
+    samples are stored more precisely than loud ones. The bits are inverted,
+    as they are in G.711.
+
+    Arguments:
+    samples -- numpy array of 16-bit samples
+    """
+
+    samples = numpy.asarray(samples, dtype=numpy.int32)
+    sign = numpy.where(samples < 0, 0x80, 0)
+    magnitude = numpy.minimum(numpy.abs(samples), MU_LAW_CLIP) + MU_LAW_BIAS
+    # frexp gives the power of 2 above the magnitude, and the bias puts the first segment at 2**7
+    segment = numpy.frexp(magnitude)[1] - 8
+    position = (magnitude >> (segment + 3)) & 0x0F
+    return (~(sign | (segment << 4) | position) & 0xFF).astype(numpy.uint8)
+
+
+def decode_mu_law(codes):
+    """Return 8-bit mu-law codes expanded to a numpy array of 16-bit samples.
+
+    Arguments:
+    codes -- numpy array of 8-bit mu-law codes
+    """
+
+    # Every code is decoded once, then looked up
+    every_code = ~numpy.arange(256) & 0xFF
+    segment = (every_code >> 4) & 0x07
+    magnitude = ((((every_code & 0x0F) << 3) + MU_LAW_BIAS) << segment) - MU_LAW_BIAS
+    samples = numpy.where(every_code & 0x80, -magnitude, magnitude).astype(numpy.int16)
+    return samples[numpy.asarray(codes, dtype=numpy.uint8)]
+
+
+def decode_adpcm(data, channels, block_align):
+    """Return IMA ADPCM blocks expanded to a numpy array of interleaved 16-bit samples.
+
+    As with AdpcmEncoder, the nth sample of every block is decoded at once.
+    If the last block is short, only the samples it holds are returned.
+
+    Arguments:
+    data -- numpy array of the bytes of the blocks
+    channels -- number of channels
+    block_align -- the number of bytes in a block
+    """
+
+    data = numpy.asarray(data, dtype=numpy.uint8)
+    samples_per_block = (block_align - 4 * channels) * 2 // channels + 1
+    partial = len(data) % block_align
+    frame_count = len(data) // block_align * samples_per_block
+    if partial > 4 * channels:
+        frame_count += (partial - 4 * channels) * 2 // channels + 1
+    data = numpy.concatenate([data, numpy.zeros(-len(data) % block_align, dtype=numpy.uint8)])
+    block_count = len(data) // block_align
+    rows = block_count * channels
+    if rows == 0:
+        return numpy.zeros(0, dtype=numpy.int16)
+
+    blocks = data.reshape(block_count, block_align)
+    header = blocks[:, :4 * channels].reshape(rows, 4)
+    predictor = header[:, :2].copy().view('<i2')[:, 0].astype(numpy.int32)
+    index = numpy.minimum(header[:, 2], len(ADPCM_STEPS) - 1).astype(numpy.int32)
+
+    # The bytes of each channel are in groups of 4, two codes to a byte
+    packed = blocks[:, 4 * channels:].reshape(block_count, -1, channels, 4).transpose(0, 2, 1, 3)
+    packed = packed.reshape(rows, -1)
+    codes = numpy.empty((samples_per_block - 1, rows), dtype=numpy.int32)
+    codes[0::2] = (packed & 0x0F).T
+    codes[1::2] = (packed >> 4).T
+    changes, next_indices = _get_adpcm_tables()
+
+    samples = numpy.empty((samples_per_block, rows), dtype=numpy.int16)
+    samples[0] = predictor
+    for i in xrange(samples_per_block - 1):
+        table_index = index * 16 + codes[i]
+        predictor = numpy.clip(predictor + changes[table_index], MIN_SAMPLE, MAX_SAMPLE)
+        index = next_indices[table_index]
+        samples[i + 1] = predictor
+
+    samples = samples.reshape(samples_per_block, block_count, channels).transpose(1, 0, 2)
+    return samples.reshape(-1)[:frame_count * channels]
+
+
+def _get_adpcm_tables():
+    """Return numpy arrays of the change to the sample and the next step index for every IMA ADPCM code.
+
+    Both are indexed by step index * 16 + code, so that looking them up
+    for many blocks at once takes one step.
+    """
+
+    steps = numpy.array(ADPCM_STEPS).reshape(-1, 1)
+    codes = numpy.arange(16)
+    magnitudes = codes & 7
+    changes = steps >> 3
+    changes = changes + numpy.where(magnitudes & 4, steps, 0)
+    changes = changes + numpy.where(magnitudes & 2, steps >> 1, 0)
+    changes = changes + numpy.where(magnitudes & 1, steps >> 2, 0)
+    changes = numpy.where(codes & 8, -changes, changes)
+
+    index_changes = numpy.array(ADPCM_INDEX_CHANGES)[magnitudes]
+    next_indices = numpy.clip(numpy.arange(len(ADPCM_STEPS)).reshape(-1, 1) + index_changes, 0,
+                              len(ADPCM_STEPS) - 1)
+    return changes.ravel().astype(numpy.int32), next_indices.ravel().astype(numpy.int32)
+
+
+class ClipMode(Enum):
+    """Enum for different ways of keeping mixed samples in range"""
+    # Arbitrary numbers for enum
+    hard = 0
+    soft = 1
+
+
+class Encoding(Enum):
+    """Enum for different ways of storing samples in a wav file"""
+    # The format tags of the encodings in a wav file
+    pcm = 1
+    mu_law = 7
+    ima_adpcm = 17
@@ -0,0 +1,101 @@
+"""Contain a class for streaming audio a frame at a time.
+
+This module contains a class that turns blocks of samples, generated as
+they are needed, into frames of a fixed size that can be pulled one at a
+time, such as by an audio callback. Only the blocks needed for each frame
+are generated, so the time taken to produce a frame doesn't depend on how
+long the whole sound is.
+
+Classes:
+FrameStream -- class for pulling fixed-size frames from blocks of samples
+"""
+
+
+# Additional libraries
+import numpy
+
+# Own modules
+import sound
+
+
+# Default number of samples in a frame, about 12ms at 44.1kHz
+FRAME_SIZE = 512
+
+
+class FrameStream(object):
+
+    """Contain methods and fields for pulling frames from blocks of samples.
+
+    This class reads from an iterator of blocks of samples, such as the
+    blocks generated by a Tone, and returns them as frames of frame_size
+    samples. Blocks are only generated when a frame needs them, so they
+    should be no longer than a frame to keep the time per frame bounded.
+    Frames are 16-bit numpy arrays, converted from the blocks with
+    sound.quantise, and tostring can be used to get their bytes for audio
+    APIs that take a buffer. After the last block, the rest
+    of the frame and any later frames are silent.
+
+    Public Methods:
+    read_frame -- returns the next frame
+    iter_frames -- generates frames until the stream is finished
+
+    Public Fields and Properties:
+    frame_size -- the number of samples in each frame
+    finished -- whether every block has been read
+    samples_read -- the number of samples, not counting padding, read so far
+    """
+
+    def __init__(self, blocks, frame_size=FRAME_SIZE):
+        """Initialise the fields.
+
+        Arguments:
+        blocks -- iterable of numpy arrays of samples, generated as they are needed
+        frame_size -- the number of samples in each frame. Defaults to FRAME_SIZE
+        """
+
+        self.frame_size = frame_size
+        self.samples_read = 0
+        self.__blocks = iter(blocks)
+        # The part of the current block that hasn't been read, None after the last block
+        self.__pending = numpy.zeros(0, dtype=numpy.int16)
+        self.__next_block()
+
+    @property
+    def finished(self):
+        return self.__pending is None
+
+    def read_frame(self):
+        """Return the next frame_size samples as a 16-bit numpy array.
+
+        Samples are rounded, and those outside the 16-bit range are clipped.
+        Once the stream is finished, frames are filled with silence.
+        """
+
+        frame = numpy.zeros(self.frame_size, dtype=numpy.int16)
+        filled = 0
+        while filled < self.frame_size and self.__pending is not None:
+            count = min(len(self.__pending), self.frame_size - filled)
+            frame[filled:filled + count] = sound.quantise(self.__pending[:count])
+            self.__pending = self.__pending[count:]
+            filled += count
+            if len(self.__pending) == 0:
+                # Look ahead so that finished is known as soon as the last sample is read
+                self.__next_block()
+
+        self.samples_read += filled
+        return frame
+
+    def iter_frames(self):
+        """Generate frames until the stream is finished, the last padded with silence."""
+
+        while not self.finished:
+            yield self.read_frame()
+
+    def __next_block(self):
+        """Move on to the next non-empty block, or set pending to None if there are none left."""
+
+        for block in self.__blocks:
+            if len(block) > 0:
+                self.__pending = block
+                return
+        self.__pending = None
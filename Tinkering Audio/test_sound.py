@@ -0,0 +1,65 @@
+"""Contain tests for the sound module.
+
+Run them from this directory with:
+python -m unittest test_sound
+
+Classes:
+SoundTest -- tests for creating and combining Sounds
+"""
+
+
+# Standard Python libraries
+import array
+import unittest
+
+# Own modules
+import sound
+
+
+class SoundTest(unittest.TestCase):
+
+    """Test creating and combining Sounds."""
+
+    def test_int16_array_samples(self):
+        """A Sound can begin with a 16-bit array, as sounds did before they were stored as floats."""
+
+        values = array.array('h', [0, 1, -1, 32767, -32768])
+        new_sound = sound.Sound(samples=values)
+        self.assertEqual(list(new_sound.samples), list(values))
+
+    def test_add_mono_to_stereo(self):
+        """Adding mono and stereo sounds gives a stereo sound with the mono sound in the centre."""
+
+        mono = sound.Sound(samples=[1000.0, 1000.0, 1000.0])
+        stereo = sound.Sound(channels=2, samples=[100.0, 200.0])
+        centre_gain = sound.get_pan_gains(0.0, 2)[0]
+
+        for total in (mono + stereo, stereo + mono):
+            self.assertEqual(total.channels, 2)
+            self.assertEqual(len(total), 3)
+            expected = [100.0 + 1000.0 * centre_gain, 200.0 + 1000.0 * centre_gain] + [1000.0 * centre_gain] * 4
+            for sample, expected_sample in zip(total.samples, expected):
+                self.assertAlmostEqual(sample, expected_sample, places=2)
+
+    def test_combine_own_samples_past_end(self):
+        """Mixing a sound's own samples in past its end copies them before the sound grows."""
+
+        # Whether the samples move depends on the allocator, so several lengths are tried
+        for length in (1000, 100000, 1000000):
+            original = sound.Sound(samples=[100.0] * length)
+            original.combine_samples_at_index(original.samples, len(original))
+            self.assertEqual(len(original), 2 * length)
+            self.assertEqual(set(original.samples), set([100.0]))
+
+    def test_combine_own_chunk_past_end(self):
+        """Mixing a chunk of a sound back into it past its end mixes the chunk's original samples."""
+
+        for length in (1000, 100000, 1000000):
+            original = sound.Sound(samples=[100.0] * length)
+            original.combine_samples_at_index(next(original.iter_chunks(1000)), len(original))
+            self.assertEqual(len(original), length + 1000)
+            self.assertEqual(set(original.samples), set([100.0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
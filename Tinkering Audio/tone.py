@@ -6,19 +6,51 @@ properties.
 
 Classes:
 Tone -- class that all tones inherit from
-SineTone(Tone) -- class for generating a sine tone
-SquareTone(Tone) -- class for generating a square tone
+WavetableTone(Tone) -- class that tones read from a wavetable inherit from
+SineTone(WavetableTone) -- class for generating a sine tone
+SquareTone(WavetableTone) -- class for generating a square tone
+SawTone(WavetableTone) -- class for generating a sawtooth tone
+TriangleTone(WavetableTone) -- class for generating a triangle tone
 HarmonicSawTone(Tone) -- class for generating a sawtooth tone
-Noise(Tone) -- class for generating white noise
+Noise(Tone) -- class for generating white, pink or brown noise
+Voice -- class for a note played by a tone
+VoicePool -- class for reusing Voices
+NoiseColour(Enum) -- enum to store the spectra that noise can have
+
+Functions:
+convert_note_to_freq -- converts a note number to a frequency
 """
 
 
-# Standard Python libraries
-import math
-import random
+# Standard Python library
+import copy
+
+# Additional libraries
+from enum import Enum
+import numpy
 
 # Own modules
+import effects
+import profiler
 import sound
+import stream
+import wavetable
+
+
+# Number of samples rendered at once by the block renderer
+BLOCK_SIZE = 4096
+# The frequency of the A above middle C
+BASE_FREQUENCY = 440
+# Used to calculate frequency increment between semitones
+INTERVAL = 2.0**(1.0/12.0)
+# Coefficients and gains of the one-pole filters added together to make pink
+# noise, from Paul Kellet's economy pink noise filter
+PINK_FILTERS = [(0.99765, 0.0990460), (0.96300, 0.2965164), (0.57000, 1.0526913)]
+# Gain of the white noise added to the pink noise filters
+PINK_WHITE_GAIN = 0.1848
+# Coefficient of the leaky integrator that makes brown noise, near 1 for a
+# steep spectrum, but less than 1 so that it doesn't drift away from 0
+BROWN_COEFFICIENT = 0.995
 
 
 class Tone(object):
@@ -29,12 +61,23 @@ class Tone(object):
     The tones are set up as if they were a particular instrument playing a
     particular note. Each instance of a Tone subclass has an associated note,
     amplitude and duration.
+    A tone can also be used as an instrument that plays other notes, by
+    passing a Voice holding the note and duration to the methods that render
+    it. The tone isn't changed when it renders a voice, so the same tone can
+    render different voices in several threads at once.
     This class should not be used directly, tones should be created through its
     subclasses.
 
     Public Methods:
+    create_tone -- create the tone in a new sound
     add_tone -- add the tone to a sound
     combine_tone -- layer the tone over a sound
+    write_tone -- write the tone to a sound.SoundWriter as it is generated
+    create_tones -- create many notes, durations and amplitudes of the tone at once
+    generate_blocks -- generate the tone's samples a block at a time
+    stream_tone -- return a stream.FrameStream that generates the tone as frames are read
+    get_render_key -- return a key identifying the samples the tone will produce
+    get_voice -- return a Voice for the tone's own note and duration
 
     Public Fields and Properties:
     note -- the note of the tone
@@ -42,6 +85,7 @@ class Tone(object):
     seconds -- the length of the tone
     amplitude_env -- the amplitude envelope to apply to the tone
     frequency_env -- the frequency envelope to apply to the tone
+    block_size -- the number of samples rendered at once, or None to render the whole tone at once
     """
 
     def __init__(self, note, amplitude, seconds, amplitude_env=None, frequency_env=None):
@@ -60,6 +104,7 @@ class Tone(object):
         self.seconds = seconds
         self.amplitude_env = amplitude_env
         self.frequency_env = frequency_env
+        self.block_size = BLOCK_SIZE
 
     @property
     def frequency(self):
@@ -77,196 +122,341 @@ class Tone(object):
     def note(self, value):
         if not isinstance(self, Noise):
             self.__note = value
-            self.__frequency = self.__convert_note_to_freq(self.note)
+            self.__frequency = convert_note_to_freq(self.note)
+
+    def get_voice(self):
+        """Return a new Voice for the tone's own note and duration."""
+
+        return Voice(self.note, self.seconds, self.frequency)
 
-    def create_tone(self):
-        """Create a tone in a new Sound object instance"""
-        new_tone = sound.Sound()
-        self.add_tone(new_tone)
+    def create_tone(self, voice=None, sampling_rate=44100):
+        """Create a tone in a new Sound object instance
+
+        Arguments:
+        voice -- the Voice to render. Defaults to None (the tone's own note and duration)
+        sampling_rate -- the sampling rate to render the tone at. Defaults to 44100
+        """
+        new_tone = sound.Sound(sampling_rate=sampling_rate)
+        self.add_tone(new_tone, voice)
         return new_tone
 
-    def add_tone(self, sound):
+    def add_tone(self, sound, voice=None):
         """Add a tone to the end of given Sound object instance.
 
         Arguments:
         sound -- Sound object tone should be added to
+        voice -- the Voice to render. Defaults to None (the tone's own note and duration)
+        """
+        for block in self.__generate(sound, voice or self.get_voice()):
+            sound.combine_samples_at_index(block, len(sound))
+
+    def create_tones(self, notes, durations, amplitudes=None, sampling_rate=44100, stacked=False):
+        """Create variants of the tone with different notes, durations and amplitudes at once.
+
+        This method renders every variant in one pass, rather than one tone at
+        a time. Variants with the same duration are rendered together as the
+        rows of one array, so each envelope curve is only worked out once for
+        each duration. Notes, durations and amplitudes can each be a single
+        value shared by every variant, or a sequence with one value per variant.
+        The variants are returned as a list of Sounds, or if stacked is True,
+        as a tuple of a 2D numpy array of 32-bit float samples with one row per
+        variant, padded with silence to the longest variant, and a numpy array
+        of the length of each variant in samples.
+
+        Arguments:
+        notes -- the note numbers of the variants
+        durations -- the lengths of the variants in seconds
+        amplitudes -- the amplitudes of the variants. Defaults to None (the tone's amplitude)
+        sampling_rate -- the sampling rate to render the variants at. Defaults to 44100
+        stacked -- whether to return one array rather than a list of Sounds. Defaults to False
         """
-        for sample in self.__generate(sound):
-            sound.add_sample(sample)
 
-    def combine_tone(self, sound, start_position):
+        if amplitudes is None:
+            amplitudes = self.amplitude
+        notes, durations, amplitudes = numpy.broadcast_arrays(numpy.atleast_1d(notes), durations, amplitudes)
+        # Truncated like sound.Sound.convert_secs_to_samples
+        lengths = (sampling_rate * durations).astype(int)
+        variants = numpy.zeros((len(notes), lengths.max() if len(lengths) else 0), dtype=numpy.float32)
+
+        # Only used for its sampling rate
+        format_sound = sound.Sound(sampling_rate=sampling_rate)
+        # Tones without a note, such as Noise, have no frequency to vary
+        has_note = self.get_voice().note is not None
+        for seconds in numpy.unique(durations):
+            rows = numpy.nonzero(durations == seconds)[0]
+            # Columns, so each row of a block is rendered with its own note and amplitude
+            row_notes = notes[rows, numpy.newaxis] if has_note else None
+            voice = Voice(row_notes, float(seconds), None, amplitudes[rows, numpy.newaxis])
+
+            start_index = 0
+            for block in self.__generate(format_sound, voice):
+                count = block.shape[-1]
+                variants[rows, start_index:start_index + count] = block
+                start_index += count
+
+        if stacked:
+            return variants, lengths
+        return [sound.Sound(sampling_rate=sampling_rate, samples=variant[:length])
+                for variant, length in zip(variants, lengths)]
+
+    def combine_tone(self, sound, start_position, pan=None):
         """Combine the tone with a Sound object.
 
         This method combines the tone with a given sound object instance,
         starting at the given time. This can be used to add tones to a sound
         without having to create an  additional Sound object.
         If the tone is longer than the sound, it will extend past the end
-        of the sound.
+        of the sound. If the sound has more than one channel, the tone is
+        played in every channel unless a pan is given.
 
         Arguments:
         sound -- Sound object instance
         start_position -- start position in seconds
+        pan -- where to place the tone between the channels, from -1 to 1. Defaults to None (every channel)
         """
 
         index = sound.convert_secs_to_samples(start_position)
-        for sample in self.__generate(sound):
-            if index < len(sound.samples):
-                sound.combine_sample_at_index(sample, index)
-            else:
-                sound.add_sample(sample)
-            index += 1
-
-    def _get_amplitude(self, sampling_rate, sample_index):
-        """Return the amplitude after any envelopes have been applied to it.
+        for block in self.__generate(sound, self.get_voice()):
+            sound.combine_samples_at_index(block, index, pan)
+            index += len(block)
+
+    def write_tone(self, writer):
+        """Write the tone to a SoundWriter a block at a time.
 
-        This method returns the amplitude for a specific sample
-        after any envelopes have been applied to it.
+        This method writes each block to the file as soon as it is generated,
+        so the whole tone is never kept in memory.
 
         Arguments:
-        sampling_rate -- the sampling rate of the sound as an integer
-        sample_index -- the index of the sample that the amplitude should be retrieved
+        writer -- sound.SoundWriter the tone should be written to
         """
 
-        if self.amplitude_env != None:
-            amplitude = self.amplitude_env.get_value(self.amplitude, sample_index, (self.seconds * sampling_rate))
-            return amplitude
+        for block in self.generate_blocks(writer.sampling_rate):
+            writer.write_samples(block)
+
+    def generate_blocks(self, sampling_rate=44100, block_size=None, voice=None):
+        """Generate the tone's samples as numpy arrays of up to block_size samples.
+
+        Each block is only generated when it is asked for. The tone and the
+        voice should not be changed until the last block has been generated.
+
+        Arguments:
+        sampling_rate -- the sampling rate to generate the tone at. Defaults to 44100
+        block_size -- the maximum number of samples in each block. Defaults to None (the tone's block_size)
+        voice -- the Voice to render. Defaults to None (the tone's own note and duration)
+        """
+
+        # Only used for its sampling rate
+        format_sound = sound.Sound(sampling_rate=sampling_rate)
+        return self.__generate(format_sound, voice or self.get_voice(), block_size)
+
+    def stream_tone(self, sampling_rate=44100, frame_size=stream.FRAME_SIZE):
+        """Return a stream.FrameStream that generates the tone as its frames are read.
+
+        Blocks are generated one frame long, so each frame only takes as long
+        as generating a frame's worth of the tone. The stream uses a copy of
+        the tone, so the tone can be changed while it is being streamed.
+
+        Arguments:
+        sampling_rate -- the sampling rate to generate the tone at. Defaults to 44100
+        frame_size -- the number of samples in each frame. Defaults to stream.FRAME_SIZE
+        """
+
+        return stream.FrameStream(copy.copy(self).generate_blocks(sampling_rate, frame_size), frame_size)
+
+    def get_render_key(self, sampling_rate, voice=None):
+        """Return a key identifying the samples the tone will produce.
+
+        Tones with the same key produce the same samples, so the key can be
+        used to cache rendered tones. The key is a tuple of the tone's class,
+        note, duration in samples, amplitude, envelope parameters and the
+        sampling rate.
+
+        Arguments:
+        sampling_rate -- the sampling rate the tone will be rendered at
+        voice -- the Voice to render. Defaults to None (the tone's own note and duration)
+        """
+
+        voice = voice or self.get_voice()
+        return (type(self), voice.note, voice.seconds * sampling_rate, self.__get_voice_amplitude(voice),
+                self.__get_envelope_key(self.amplitude_env),
+                self.__get_envelope_key(self.frequency_env), sampling_rate)
+
+    def __get_voice_amplitude(self, voice):
+        """Return the amplitude of the voice, which is the tone's amplitude unless the voice has its own."""
+
+        if voice.amplitude is not None:
+            return voice.amplitude
         else:
             return self.amplitude
 
-    def _get_frequency(self, sampling_rate, sample_index):
-        """Return the frequency after any envelopes have been applied to it.
+    def __get_envelope_key(self, envelope):
+        """Return the key of the envelope, or None if there is no envelope."""
+
+        if envelope != None:
+            return envelope.key
+        else:
+            return None
+
+    def _get_amplitude(self, voice, sampling_rate, start_index, count):
+        """Return the amplitude after any envelopes have been applied to it.
 
-        This method returns the frequency for a specific sample
-        after any envelopes have been applied to it.
+        This method returns the amplitude for a block of samples
+        after any envelopes have been applied to it. If there is no
+        envelope the amplitude is returned as a single number, otherwise
+        it is returned as an array with one value per sample.
 
         Arguments:
+        voice -- the Voice being rendered
         sampling_rate -- the sampling rate of the sound as an integer
-        sample_index -- the index of the sample that the frequency should be retrieved
+        start_index -- the index of the first sample in the block
+        count -- the number of samples in the block
         """
-        if self.frequency_env != None:
-            frequency = self.frequency_env.get_value(self.frequency, sample_index, (self.seconds * sampling_rate))
-            return frequency
+
+        amplitude = self.__get_voice_amplitude(voice)
+        if self.amplitude_env != None:
+            return self.__apply_envelope(self.amplitude_env, amplitude, voice, sampling_rate,
+                                         start_index, count)
         else:
-            return self.frequency
+            return amplitude
 
-    def __convert_note_to_freq(self, note):
-        """Convert an integer note number to a frequency value and return it.
+    def _get_frequency(self, voice, sampling_rate, start_index, count):
+        """Return the frequency after any envelopes have been applied to it.
 
-        This method converts an integer note value to a frequency value. The A
-        above middle C is 0, and each integer above or below is a semitone above
-        or below respectively. Floats can be used to represent intervals smaller
-        than a semitone. Frequency is returned as a float.
+        This method returns the frequency for a block of samples
+        after any envelopes have been applied to it. If there is no
+        envelope the frequency is returned as a single number, otherwise
+        it is returned as an array with one value per sample.
 
         Arguments:
-        note -- the note number to convert to a frequency
+        voice -- the Voice being rendered
+        sampling_rate -- the sampling rate of the sound as an integer
+        start_index -- the index of the first sample in the block
+        count -- the number of samples in the block
         """
 
-        # The frequency of the A above middle C
-        BASE_FREQUENCY = 440
-        # Used to calculate frequency increment between semitones
-        INTERVAL = 2.0**(1.0/12.0)
-        frequency = BASE_FREQUENCY * INTERVAL ** note
-        return frequency
+        if self.frequency_env != None:
+            return self.__apply_envelope(self.frequency_env, voice.frequency, voice, sampling_rate,
+                                         start_index, count)
+        else:
+            return voice.frequency
 
-    def __generate(self, sound):
-        """Generate samples for the tone.
+    def __apply_envelope(self, envelope, default_value, voice, sampling_rate, start_index, count):
+        """Return an array of envelope values for a block of samples, with a row for each row of the voice."""
 
-        This generator yields samples corresponding to the tones properties.
+        curve = envelope.render(voice.seconds * sampling_rate, default_value)
+        return curve[..., start_index:start_index + count]
+
+    @profiler.measure('Tone.generate',
+                      lambda self, sound, voice, *args: sound.convert_secs_to_samples(voice.seconds))
+    def __generate(self, sound, voice, block_size=None):
+        """Generate blocks of samples for a voice played by the tone.
+
+        This generator yields arrays of samples corresponding to the tone's
+        properties and the voice's note and duration, block_size samples at a
+        time (or the whole tone at once if neither block_size nor the tone's
+        block_size is set).
         The sound object the tone is being applied to is supplied to ensure
         that the matching sampling rate is used.
-        The previous sine wave phase is tracked in order to calculate the
-        next value.
+        The wave's phase at the end of each block is tracked in order to
+        calculate the next block.
 
         Arguments:
         sound -- the sound.Sound object the tone is being generated for
+        voice -- the Voice to render
+        block_size -- the number of samples in each block. Defaults to None (the tone's block_size)
         """
 
-        sample_count = sound.convert_secs_to_samples(self.seconds)
+        sample_count = sound.convert_secs_to_samples(voice.seconds)
+        block_size = block_size or self.block_size or max(sample_count, 1)
         # No previous sample so start at 0
         previous_phase = 0
-        for i in xrange(sample_count):
-            sample, previous_phase = self._create_sample(sound.sampling_rate, i, previous_phase)
-            yield sample
+        for start_index in xrange(0, sample_count, block_size):
+            count = min(block_size, sample_count - start_index)
+            block, previous_phase = self._create_block(voice, sound.sampling_rate, start_index, count,
+                                                       previous_phase)
+            yield block
 
-    def _get_sine_value(self, sampling_rate, sample_index, previous_phase):
-        """Return the sine value for the current phase and the previous phase.
+    def _get_wave_block(self, waveform, voice, sampling_rate, start_index, count, previous_phase):
+        """Return the waveform's values for a block and the phase of its last sample.
 
-        This method returns the value for the current phase of the sine wave corresponding
-        to the sample number. It also returns the value of the phase of the sine wave
-        for the previous sample.
-        These values are returned as a tuple.
+        This method reads the values for each sample in the block from the
+        shared wavetable for the waveform, at the tone's frequency for each
+        sample. The phase is measured in cycles and carries on from the phase
+        of the previous sample.
+        The values and the final phase are returned as a tuple.
 
         Arguments:
+        waveform -- the waveform to read as a wavetable.Waveform
+        voice -- the Voice being rendered
         sampling_rate -- the sampling rate of the sound
-        sample_index -- the position of the sample to be used in the calculation
-        previous_phase -- the previous phase, to be used in the calculation
+        start_index -- the index of the first sample in the block
+        count -- the number of samples in the block
+        previous_phase -- the phase of the sample before the block
         """
 
-        frequency = self._get_frequency(sampling_rate, sample_index)
-        seconds_per_cycle = 1.0/frequency
-        samples_per_cycle = seconds_per_cycle * sampling_rate
-        cycle_size = 2.0 * math.pi
+        frequency = self._get_frequency(voice, sampling_rate, start_index, count)
+        table = wavetable.Wavetable.get_table(waveform)
+        return table.read(frequency, sampling_rate, count, previous_phase)
 
-        phase_increment = cycle_size / samples_per_cycle
-        phase = previous_phase + phase_increment
-        sine_value = math.sin(phase)
-        return sine_value, phase
+    def _create_block(self, voice, sampling_rate, start_index, count, previous_phase):
+        raise NotImplementedError("Subclasses must implement _create_block")
 
-    def _create_sample(self, sound, index, value):
-        raise NotImplementedError("Subclasses must implement _create_sample")
 
-
-class SineTone(Tone):
+class WavetableTone(Tone):
 
     """
-    Store a method for creating square tone samples.
+    Store a method for creating tone samples from a wavetable.
 
-    This class has one method that is called by its parent
-    to create samples for a sine tone sound.
+    This class has one method that is called by its parent to create
+    samples by reading through the wavetable of its waveform.
+    This class should not be used directly, its subclasses set the waveform.
     """
 
-    def _create_sample(self, sampling_rate, sample_index, previous_phase):
-        """Return a sample value using a sine wave.
+    waveform = None
+
+    def _create_block(self, voice, sampling_rate, start_index, count, previous_phase):
+        """Return a block of sample values read from the waveform's wavetable.
 
-        This method creates a sample for a sine tone using a sine wave.
-        It also returns the sine wave's phase as it is needed for correctly
-        calculating the next sample.
-        The sample value and sine wave phase are returned as a tuple.
+        This method creates a block of samples by reading the tone's waveform
+        from its wavetable and multiplying by the amplitude.
+        It also returns the phase as it is needed for correctly calculating
+        the next block.
+        The samples and phase are returned as a tuple.
         """
 
-        amplitude = self._get_amplitude(sampling_rate, sample_index)
-        sine_value, phase = self._get_sine_value(sampling_rate, sample_index, previous_phase)
-        sample = int(sine_value * amplitude)
-        return sample, phase
+        amplitude = self._get_amplitude(voice, sampling_rate, start_index, count)
+        wave_values, phase = self._get_wave_block(self.waveform, voice, sampling_rate, start_index, count,
+                                                  previous_phase)
+        samples = wave_values * amplitude
+        return samples, phase
 
 
-class SquareTone(Tone):
+class SineTone(WavetableTone):
 
-    """
-    Store a method for creating square tone samples.
+    """Create sine tone samples from the sine wavetable."""
 
-    This class has one method that is called by its parent
-    to create samples for a square tone sound.
-    """
+    waveform = wavetable.Waveform.sine
 
-    def _create_sample(self, sampling_rate, sample_index, previous_phase):
-        """Return a sample value using a square wave.
 
-        This method creates a sample for a square tone based on the signs of
-        a sine wave.
-        It also returns the sine wave's phase as it is needed for correctly
-        calculating the next sample.
-        The sample value and sine wave phase are returned as a tuple.
-        """
+class SquareTone(WavetableTone):
 
-        sine_value, phase = self._get_sine_value(sampling_rate, sample_index, previous_phase)
-        amplitude = self._get_amplitude(sampling_rate, sample_index)
-        if sine_value != 0:
-            # Because a sign function doesn't exist in Python
-            sample = int(amplitude * math.copysign(1, sine_value) )
-        else:
-            sample = 0
-        return sample, phase
+    """Create square tone samples from the square wavetable."""
+
+    waveform = wavetable.Waveform.square
+
+
+class SawTone(WavetableTone):
+
+    """Create sawtooth tone samples from the sawtooth wavetable."""
+
+    waveform = wavetable.Waveform.saw
+
+
+class TriangleTone(WavetableTone):
+
+    """Create triangle tone samples from the triangle wavetable."""
+
+    waveform = wavetable.Waveform.triangle
 
 
 class HarmonicSawTone(Tone):
@@ -297,28 +487,53 @@ class HarmonicSawTone(Tone):
         super(HarmonicSawTone, self).__init__(note, amplitude, seconds, amplitude_env, frequency_env)
         self.levels = levels
 
-    def _create_sample(self, sampling_rate, sample_index, previous_phase):
-        """Return a sawtooth wave sample generated using harmonic sine waves.
+    def get_render_key(self, sampling_rate, voice=None):
+        """Return a key identifying the samples the tone will produce, including its levels."""
+
+        return super(HarmonicSawTone, self).get_render_key(sampling_rate, voice) + (self.levels,)
+
+    def _create_block(self, voice, sampling_rate, start_index, count, previous_phase):
+        """Return a block of sawtooth wave samples generated using harmonic sine waves.
 
-        This method creates a sample for a sawtooth tone using combinations of
-        harmonic sine waves.
-        It also returns the sine wave's phase as it is needed for correctly
-        calculating the next sample.
-        The sample value and sine wave phase are returned as a tuple.
+        This method creates a block of samples for a sawtooth tone by adding
+        together harmonic sine waves, each divided by its harmonic number.
+        Each harmonic is calculated for the whole block at once from the two
+        below it, using the recurrence sin((k+1)x) = 2cos(x)sin(kx) - sin((k-1)x),
+        so only one sine and one cosine are calculated per sample.
+        Harmonics at or above the Nyquist frequency can't be represented at the
+        sampling rate, so they are left out for the samples where they would be.
+        It also returns the fundamental's phase as it is needed for correctly
+        calculating the next block.
+        The samples and phase are returned as a tuple.
         """
 
-        sample = 0
-        frequency = self.frequency
+        frequency = self._get_frequency(voice, sampling_rate, start_index, count)
+        amplitude = self._get_amplitude(voice, sampling_rate, start_index, count)
+        nyquist = sampling_rate / 2.0
+
+        # Phase of the fundamental in cycles, carried on from the previous block
+        phases = numpy.cumsum(numpy.zeros(count) + frequency / float(sampling_rate), axis=-1)
+        # As a column when there is a phase for each row
+        phases += numpy.reshape(previous_phase, numpy.shape(previous_phase) + (1,))
+        phases %= 1.0
+        angles = 2.0 * numpy.pi * phases
+
+        wave = numpy.zeros(phases.shape)
+        previous_harmonic = numpy.zeros(phases.shape)
+        harmonic = numpy.sin(angles)
+        twice_cos = 2.0 * numpy.cos(angles)
         # To levels + 1, as range stops before it. Start at 1 so calculations are correct.
         for i in xrange(1, self.levels + 1):
-            amplitude = self._get_amplitude(sampling_rate, sample_index)
-            # Divide amplitude by harmonic number
-            amplitude = float(amplitude) / i
-            sine_value, phase = self._get_sine_value(sampling_rate, sample_index, previous_phase)
-            sample += int(sine_value * amplitude)
-            # Next harmonic
-            frequency += self.frequency
-        return sample, phase
+            audible = i * frequency < nyquist
+            if not numpy.any(audible):
+                # Higher harmonics won't be audible either
+                break
+            # Divide by harmonic number
+            wave += harmonic * audible / i
+            previous_harmonic, harmonic = harmonic, twice_cos * harmonic - previous_harmonic
+
+        samples = wave * amplitude
+        return samples, phases[..., -1]
 
 
 class Noise(Tone):
@@ -329,30 +544,204 @@ class Noise(Tone):
     This class has a method that is called by its parent that
     generates random noise samples.
     Only seconds and amplitude are used by this class.
+    The noise can be white, or pink or brown, which have more of their
+    power at low frequencies. If it has a seed, the same samples are
+    generated every time it is rendered, so it can be cached like a tone.
+
+    Public Fields and Properties:
+    colour -- the spectrum of the noise as a NoiseColour
+    seed -- the seed of the random numbers, or None for different noise every time
     """
 
     # Overriding init and setting a default value for the note was the only way I could
     # find to not require parameters but still subclass in Python
-    def __init__(self, amplitude, seconds, note=None ,amplitude_env=None, frequency_env=None):
+    def __init__(self, amplitude, seconds, note=None ,amplitude_env=None, frequency_env=None, colour=None,
+                 seed=None):
         """Initialises the fields.
 
         Arguments:
         amplitude -- integer defining the volume
         seconds -- float or integer defining how long the tone will be
+        colour -- the spectrum of the noise as a NoiseColour. Defaults to None (white)
+        seed -- integer seed of the random numbers. Defaults to None (different noise every time)
         """
 
         super(Noise, self).__init__(note, amplitude, seconds, amplitude_env, frequency_env)
+        self.colour = colour if colour != None else NoiseColour.white
+        self.seed = seed
+
+    def get_render_key(self, sampling_rate, voice=None):
+        """Return a key including the colour and seed, or None if there is no seed.
+
+        Unseeded noise is different every time it is rendered, so it can't be cached.
+        """
+
+        if self.seed == None:
+            return None
+        return super(Noise, self).get_render_key(sampling_rate, voice) + (self.colour, self.seed)
+
+    def get_voice(self):
+        """Return a new Voice for the noise's duration, which has no note or frequency."""
+
+        return Voice(None, self.seconds, None)
+
+    def _create_block(self, voice, sampling_rate, start_index, count, previous_phase):
+        """Return a block of random sample values to create noise.
+
+        This method creates a block of random values between -1 and 1, so the
+        noise has no DC offset. For pink and brown noise, they are filtered
+        with effects.OnePoleFilters over the whole block at once.
+        The random number generator and the filters are created for the
+        first block and passed on to the next block in place of the phase,
+        so a seeded noise gives the same samples however it is split into
+        blocks.
+        The samples and generator are returned as a tuple.
+        """
+
+        if start_index == 0:
+            previous_phase = self.__create_generator()
+        random_state, filters, white_gain = previous_phase
+
+        amplitude = voice.amplitude if voice.amplitude is not None else self.amplitude
+        # A row for each row of amplitudes, so batched variants get different noise
+        white = random_state.uniform(-1.0, 1.0, numpy.shape(amplitude)[:-1] + (count,))
+        # Filters work along the first axis, so the rows of a batch are filtered as columns
+        white = white.T
+        noise = white_gain * white
+        for noise_filter in filters:
+            noise += noise_filter.process(white)
+
+        samples = noise.T * amplitude
+        return samples, previous_phase
+
+    def __create_generator(self):
+        """Return a new random number generator, filters and gain of the white noise as a tuple.
+
+        The filters' gains are scaled so that pink and brown noise have the
+        same power as white noise, and so sound about as loud.
+        """
+
+        random_state = numpy.random.RandomState(self.seed)
+        if self.colour == NoiseColour.pink:
+            # Power of the sum of the filters' impulse responses and the white noise
+            power = PINK_WHITE_GAIN ** 2
+            for coefficient, gain in PINK_FILTERS:
+                power += 2 * PINK_WHITE_GAIN * gain
+                for other_coefficient, other_gain in PINK_FILTERS:
+                    power += gain * other_gain / (1.0 - coefficient * other_coefficient)
+            scale = 1.0 / numpy.sqrt(power)
+            filters = [effects.OnePoleFilter(coefficient, gain * scale) for coefficient, gain in PINK_FILTERS]
+            return random_state, filters, PINK_WHITE_GAIN * scale
+        elif self.colour == NoiseColour.brown:
+            filters = [effects.OnePoleFilter(BROWN_COEFFICIENT, numpy.sqrt(1.0 - BROWN_COEFFICIENT ** 2))]
+            return random_state, filters, 0.0
+        else:
+            return random_state, [], 1.0
+
+
+class Voice(object):
+
+    """Store the note and duration of a note played by a tone.
+
+    This class holds everything about a note that changes from note to
+    note, so that a tone can be used as an instrument that plays many notes
+    without being changed. The frequency is only recalculated when the note
+    changes. Voices are small, so they use slots rather than a dictionary,
+    and can be reused with set or a VoicePool.
+    The note, frequency and amplitude can also be numpy columns, so that a
+    tone renders a block with a row for each of them, as in create_tones.
+
+    Public Methods:
+    set -- changes the note and duration
+
+    Public Fields and Properties:
+    note -- the note number, or None for noise
+    seconds -- the length of the note in seconds
+    frequency -- the frequency of the note, or None for noise
+    amplitude -- the amplitude of the note, or None for the tone's amplitude
+    """
 
-    def _create_sample(self, sampling_rate, sample_index, previous_phase):
-        """Return a random sample value to create white noise.
+    __slots__ = ('note', 'seconds', 'frequency', 'amplitude')
 
-        This method creates a random sample in order to create noise.
-        It returns None in place of sine wave phase as Tone.__generate
-        still requires a tuple to unpack.
+    def __init__(self, note=None, seconds=0, frequency=None, amplitude=None):
+        """Initialise the fields.
+
+        Arguments:
+        note -- the note number, as used by Tone. Defaults to None (no note)
+        seconds -- the length of the note in seconds. Defaults to 0
+        frequency -- the frequency of the note. Defaults to None (calculated from the note)
+        amplitude -- the amplitude of the note. Defaults to None (the tone's amplitude)
         """
 
-        # Initial value between 0 and 1 so it can be multiplied by amplitude
-        raw_sample = random.uniform(0, 1)
-        amplitude = self.amplitude
-        sample = int(raw_sample * amplitude)
-        return sample, None
\ No newline at end of file
+        self.note = note
+        self.seconds = seconds
+        # Compared with is, as they can be numpy arrays
+        if frequency is None and note is not None:
+            frequency = convert_note_to_freq(note)
+        self.frequency = frequency
+        self.amplitude = amplitude
+
+    def set(self, note, seconds):
+        """Change the note and duration, recalculating the frequency if the note has changed."""
+
+        if note != self.note:
+            self.note = note
+            self.frequency = convert_note_to_freq(note) if note != None else None
+        self.seconds = seconds
+
+
+class VoicePool(object):
+
+    """Contain methods for reusing Voices.
+
+    This class keeps Voices that are no longer being rendered so they can be
+    reused for new notes rather than creating new ones. A pool isn't shared
+    between threads, so each renderer should have its own.
+
+    Public Methods:
+    acquire -- returns a Voice for a note and duration
+    release -- returns a Voice to the pool
+    """
+
+    def __init__(self):
+        """Initialise the fields."""
+
+        self.__free = []
+
+    def acquire(self, note, seconds):
+        """Return a Voice for the note and duration, reusing a released one if there is one."""
+
+        if self.__free:
+            voice = self.__free.pop()
+            voice.set(note, seconds)
+            return voice
+        return Voice(note, seconds)
+
+    def release(self, voice):
+        """Return a Voice that is no longer being rendered to the pool."""
+
+        self.__free.append(voice)
+
+
+def convert_note_to_freq(note):
+    """Convert an integer note number to a frequency value and return it.
+
+    This function converts an integer note value to a frequency value. The A
+    above middle C is 0, and each integer above or below is a semitone above
+    or below respectively. Floats can be used to represent intervals smaller
+    than a semitone. Frequency is returned as a float.
+
+    Arguments:
+    note -- the note number to convert to a frequency
+    """
+
+    frequency = BASE_FREQUENCY * INTERVAL ** note
+    return frequency
+
+
+class NoiseColour(Enum):
+    """Enum for the spectra that noise can have"""
+    # Arbitrary numbers for enum
+    white = 0
+    pink = 1
+    brown = 2
@@ -0,0 +1,127 @@
+"""Contain classes relating to wavetable oscillators.
+
+This module contains a class that stores a single cycle of a waveform
+so that tones can be generated by reading through it at any frequency,
+rather than calculating the waveform for every sample.
+
+Classes:
+Wavetable -- class for reading samples from a single cycle of a waveform
+Waveform(Enum) -- enum to store the waveforms that tables can be made for
+"""
+
+
+# Additional libraries
+from enum import Enum
+import numpy
+
+
+# Number of values in a single cycle of a table
+TABLE_SIZE = 2048
+
+
+class Wavetable(object):
+
+    """Contain methods and fields for a wavetable oscillator.
+
+    This class stores one cycle of a waveform. Samples are read from it using
+    a phase accumulator, which tracks how far through the cycle each sample is,
+    with linear interpolation between the values in the table.
+    Tables should be got with get_table so that there is only one table for
+    each waveform, shared by every tone that uses it.
+
+    Public Methods:
+    get_table -- returns the shared table for a waveform
+    read -- returns samples for a block along with the phase of the last sample
+    """
+
+    # One table for each waveform, made when it is first needed
+    __tables = {}
+
+    def __init__(self, values):
+        """Initialise the fields.
+
+        Arguments:
+        values -- numpy array of values for one cycle of the waveform, TABLE_SIZE long
+        """
+
+        # Extra value at the end so the last value can be interpolated towards the first
+        self.__values = numpy.append(values, values[0])
+
+    @staticmethod
+    def get_table(waveform):
+        """Return the shared Wavetable for a waveform.
+
+        Arguments:
+        waveform -- the waveform as a Waveform
+        """
+
+        if waveform not in Wavetable.__tables:
+            Wavetable.__tables[waveform] = Wavetable(Wavetable.__create_values(waveform))
+        return Wavetable.__tables[waveform]
+
+    def read(self, frequency, sampling_rate, count, previous_phase):
+        """Return a block of samples read from the table and the phase of the last one.
+
+        The phase is measured in cycles, so it is between 0 and 1. Each
+        sample's phase is the previous sample's phase plus the fraction of a
+        cycle that passes in one sample at its frequency.
+        The samples and the phase are returned as a tuple.
+        Several blocks can be read at once by giving a 2D array of frequencies,
+        or a column of them, with one row per block. The samples then have a
+        row for each block, and there is a phase for each row.
+
+        Arguments:
+        frequency -- the frequency as a number, or a numpy array with one value per sample
+        sampling_rate -- the sampling rate of the sound
+        count -- the number of samples in the block
+        previous_phase -- the phase of the sample before the block
+        """
+
+        phase_increments = numpy.zeros(count) + frequency / float(sampling_rate)
+        phases = numpy.cumsum(phase_increments, axis=-1)
+        # As a column when there is a phase for each row
+        phases += numpy.reshape(previous_phase, numpy.shape(previous_phase) + (1,))
+        phases %= 1.0
+
+        positions = phases * TABLE_SIZE
+        indices = positions.astype(int)
+        fractions = positions - indices
+        lower = self.__values[indices]
+        upper = self.__values[indices + 1]
+        return lower + fractions * (upper - lower), phases[..., -1]
+
+    @staticmethod
+    def __create_values(waveform):
+        """Return one cycle of the waveform as a numpy array of values between -1 and 1.
+
+        Every waveform starts at 0 and rises first, like a sine wave.
+        """
+
+        phases = numpy.arange(TABLE_SIZE) / float(TABLE_SIZE)
+
+        if waveform == Waveform.sine:
+            return numpy.sin(2.0 * numpy.pi * phases)
+
+        if waveform == Waveform.square:
+            # Sign of the sine wave, 0 where it crosses 0
+            values = numpy.where(phases < 0.5, 1.0, -1.0)
+            values[0] = 0
+            values[TABLE_SIZE // 2] = 0
+            return values
+
+        if waveform == Waveform.saw:
+            # Rises from 0 to 1, jumps to -1 halfway, then rises back to 0
+            return numpy.where(phases < 0.5, 2.0 * phases, 2.0 * phases - 2.0)
+
+        if waveform == Waveform.triangle:
+            # Rises to 1 at a quarter, falls to -1 at three quarters, then rises back to 0
+            return 1.0 - numpy.abs(4.0 * ((phases + 0.25) % 1.0) - 2.0)
+
+
+class Waveform(Enum):
+    """Enum for different waveforms"""
+    # Arbitrary numbers for enum
+    sine = 0
+    square = 1
+    saw = 2
+    triangle = 3